@@ -1,13 +1,62 @@
 import json
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+import askSession
+import clientManager
+import completionCache
+from campaignCache import campaign_cache
+import config
 import generateSummary
+import metrics
+import pendingCards
+import prewarm
+import rateLimit
+import summaryCache
+import bulkSummary
 import os
 
 # Configure Flask application
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# build cards for newly assigned/ active leads in the background (or run python3 prewarm.py separately)
+if prewarm.PREWARM_ENABLED:
+    prewarm.worker.start()
+
+# add a Server-Timing header with the per-request stage breakdown (override in config.py)
+TIMING_HEADERS = getattr(config, 'TIMING_HEADERS', False)
+
+# seconds a request may spend waiting for and retrying SFDC/ OpenAI calls (override in config.py)
+REQUEST_DEADLINE = getattr(config, 'REQUEST_DEADLINE', 60)
+
+# seconds before /query_lead returns a partial card with pending sections (None waits for every section);
+# the rest of the card finishes in this process after the response, so only enable it on a long-running server
+CARD_BUDGET = getattr(config, 'CARD_BUDGET', None)
+
+
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.request_timings = metrics.start_request()
+    rateLimit.set_deadline(REQUEST_DEADLINE)
+
+
+@app.after_request
+def record_timing(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_requests.inc(route=route, status=response.status_code)
+    metrics.http_seconds.observe(time.perf_counter() - g.request_start, route=route)
+    if TIMING_HEADERS and not response.is_streamed:
+        response.headers['Server-Timing'] = g.request_timings.server_timing()
+    return response
+
+
+def throttled_response(error):
+    """503 with a Retry-After hint when SFDC/ OpenAI limits leave no room for the request"""
+    return jsonify({'error': str(error), 'retry_after': error.retry_after}), 503, \
+        {'Retry-After': str(error.retry_after)}
+
 
 # checking that config and login files are present
 @app.route('/check_files', methods=['GET'])
@@ -20,6 +69,26 @@ def check_files():
     })
 
 
+def stream_events(events, sse=False):
+    """Stream card events as Server-Sent Events or newline-delimited JSON"""
+    def generate():
+        try:
+            for event in events:
+                if sse:
+                    yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+                else:
+                    yield json.dumps(event) + "\n"
+        except Exception as e:  # headers are already sent, so report errors in the stream
+            event = {'event': 'error', 'data': {'error': str(e)}}
+            if isinstance(e, rateLimit.Throttled):
+                event['data']['retry_after'] = e.retry_after
+            yield f"event: error\ndata: {json.dumps(event)}\n\n" if sse else json.dumps(event) + "\n"
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 # Query SOQL and generate AI summary
 @app.route('/query_lead', methods=['POST'])
 def query_lead():
@@ -27,15 +96,111 @@ def query_lead():
     try:
         leadID = request.json.get('lead_id')  # Lead ID from js message request
         if leadID:  # Lead ID has been received
-            summary = generateSummary.query_and_summarize_lead(leadID)
+            refresh = bool(request.json.get('refresh'))  # force a rebuild of a cached card
+            mode = request.json.get('mode')  # "sections" or "combined" generation (default from config)
+            if mode is not None and mode not in generateSummary.GENERATION_MODES:
+                return jsonify({'error': 'mode must be "sections" or "combined"'}), 400
+            stream = request.json.get('stream')  # "sse" or "ndjson" (true) to stream sections
+            if stream:
+                events = summaryCache.stream_lead_summary(leadID, refresh=refresh, mode=mode,
+                                                          stream_tokens=bool(request.json.get('stream_tokens')))
+                return stream_events(events, sse=(stream == 'sse'))
+            summary = summaryCache.get_lead_summary(leadID, refresh=refresh, mode=mode, budget=CARD_BUDGET)
             if summary:  # summary was created successfully
-                print(jsonify(summary))
                 return jsonify(summary)
             else:  # summary had generation error
                 return jsonify({'error': 'Lead ID not provided'}), 400
+    except rateLimit.Throttled as e:
+        return throttled_response(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Fetch the sections of a partial card that were still pending (request_id from /query_lead)
+@app.route('/query_lead/<request_id>', methods=['GET'])
+def query_lead_pending(request_id):
+    result = pendingCards.get(request_id)
+    if result is None:
+        return jsonify({'error': 'Request not found or expired'}), 404
+    return jsonify(result)
+
+
+# Start a bulk summary job for a call list
+@app.route('/query_leads', methods=['POST'])
+def query_leads():
+    """Queue AI summaries for many lead IDs and return a job ID to poll"""
+    try:
+        leadIDs = request.json.get('lead_ids')  # list of lead IDs from js message request
+        if not isinstance(leadIDs, list) or not leadIDs or not all(isinstance(i, str) for i in leadIDs):
+            return jsonify({'error': 'Lead IDs not provided'}), 400
+        if len(leadIDs) > bulkSummary.BULK_MAX_LEADS:
+            return jsonify({'error': f'At most {bulkSummary.BULK_MAX_LEADS} lead IDs per job'}), 400
+        return jsonify(bulkSummary.start_job(leadIDs)), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# Poll a bulk summary job (results are returned incrementally)
+@app.route('/query_leads/<job_id>', methods=['GET'])
+def query_leads_status(job_id):
+    since = request.args.get('since', 0, type=int)  # only return results after this index
+    job = bulkSummary.get_job(job_id, since)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+
+# Ask follow-up questions about a lead (session keeps the lead context and chat history per rep)
+@app.route('/ask_lead', methods=['POST'])
+def ask_lead():
+    """Answer a sales rep's question about a lead"""
+    try:
+        leadID = request.json.get('lead_id')  # Lead ID from js message request
+        question = request.json.get('question')  # rep's question
+        if not leadID or not question:
+            return jsonify({'error': 'Lead ID and question required'}), 400
+        repID = request.json.get('rep_id') or 'anonymous'  # sessions are kept per (rep, lead)
+        reset = bool(request.json.get('reset'))  # start a new conversation
+        return jsonify(askSession.ask_lead(leadID, question, repID=repID, reset=reset))
+    except rateLimit.Throttled as e:
+        return throttled_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+# SFDC/ OpenAI connection state and cold versus warm start timings
+@app.route('/client_status', methods=['GET'])
+def client_status():
+    return jsonify(clientManager.client_status())
+
+
+# Prometheus metrics: stage latencies, OpenAI tokens, SFDC API calls and errors
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# local duplicate email index state and staleness
+@app.route('/email_index', methods=['GET'])
+def email_index_status():
+    return jsonify(generateSummary.email_index.status())
+
+
+# background pre-warm worker queue, budget and counters
+@app.route('/prewarm_status', methods=['GET'])
+def prewarm_status():
+    return jsonify(prewarm.worker.status())
+
+
+# summary and completion cache hit/miss counters, campaign cache and ask session state
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    stats = summaryCache.cache_stats()
+    stats['completions'] = completionCache.cache_stats()
+    stats['campaigns'] = campaign_cache.status()
+    stats['ask_sessions'] = askSession.session_stats()
+    return jsonify(stats)
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,121 @@
+import threading
+import config
+import generateSummary
+import metrics
+import promptTemplates
+import summaryCache
+from cacheStore import LRUCache
+from singleFlight import SingleFlight
+
+
+# "Ask more" session settings (override in config.py)
+ASK_SESSION_TTL = getattr(config, 'ASK_SESSION_TTL', 1800)  # seconds an idle session is kept
+ASK_SESSION_MAX = getattr(config, 'ASK_SESSION_MAX', 500)  # max sessions kept in memory
+ASK_SESSION_MAX_BYTES = getattr(config, 'ASK_SESSION_MAX_BYTES', 50_000_000)  # memory cap for all sessions
+ASK_HISTORY_TOKEN_BUDGET = getattr(config, 'ASK_HISTORY_TOKEN_BUDGET', 2000)  # chat history sent per question
+
+sessions = LRUCache(ASK_SESSION_MAX, ttl=ASK_SESSION_TTL, max_bytes=ASK_SESSION_MAX_BYTES)
+
+stats = {'sessions_started': 0, 'questions': 0, 'history_trimmed': 0}
+stats_lock = threading.Lock()
+
+# concurrent first questions for the same session share one SFDC fetch
+session_flights = SingleFlight()
+
+
+def count(stat):
+    with stats_lock:
+        stats[stat] += 1
+
+
+def session_key(repID, leadID):
+    return f"{repID}:{leadID}"
+
+
+def load_session(repID, leadID):
+    """fetches the lead data and campaign history once (no duplicate or product queries) and
+    picks up the lead's generated sections from the card cache when present"""
+    campaign_future = generateSummary.sfdc_pool.submit(metrics.propagate(generateSummary.query_campaign_history),
+                                                       leadID)
+    lead_data = generateSummary.query_lead_data(leadID)
+    campaign_history = campaign_future.result()
+    for result in (lead_data, campaign_history):
+        if "error" in result:  # query failed
+            return result
+
+    entry = summaryCache.memory_cache.get(leadID) or {}
+    card = entry.get('summary') or {}
+    session = {
+        'lead_data': lead_data,
+        'campaign_history': campaign_history,
+        'sections': {section: card[section] for section in generateSummary.SECTIONS if section in card},
+        'history': []
+    }
+    sessions.set(session_key(repID, leadID), session)
+    count('sessions_started')
+    return session
+
+
+def get_session(repID, leadID, reset=False):
+    """returns the rep's session for this lead, starting one on first use (or on reset)"""
+    key = session_key(repID, leadID)
+    if reset:
+        sessions.delete(key)
+    session = sessions.get(key)
+    if session is None:
+        session, _ = session_flights.do(key, load_session, repID, leadID)
+    return session
+
+
+def trim_history(history, budget=None):
+    """keeps the most recent question/answer turns that fit the token budget"""
+    budget = ASK_HISTORY_TOKEN_BUDGET if budget is None else budget
+    kept, used = [], 0
+    for turn in range(len(history) - 2, -1, -2):  # newest pair first
+        pair = history[turn:turn + 2]
+        used += sum(promptTemplates.count_tokens(message["content"]) for message in pair)
+        if used > budget:
+            break
+        kept[:0] = pair
+    return kept
+
+
+def conversation(session):
+    """chat history for the next question: the card sections the rep has seen, then recent turns"""
+    history = trim_history(session['history'])
+    if len(history) < len(session['history']):
+        count('history_trimmed')
+    if session['sections']:
+        card = "\n".join(f"{section}: {text}" for section, text in session['sections'].items())
+        history = [{"role": "assistant", "content": f"Battle card shown to the sales rep:\n{card}"}] + history
+    return history
+
+
+def ask_lead(leadID, question, repID='anonymous', reset=False):
+    """answers a rep's question about a lead; follow-up questions reuse the session's lead
+    context (one completion, no SOQL) and carry the recent conversation"""
+    key = session_key(repID, leadID)
+    session = get_session(repID, leadID, reset=reset)
+    if "error" in session:
+        return session
+    count('questions')
+
+    answer = generateSummary.summarize_section("Ask more", session['lead_data'], None, session['campaign_history'],
+                                               None, user_input=question, history=conversation(session))
+    if not generateSummary.is_failed_section(answer):  # failed answers are not part of the conversation
+        session['history'] += [
+            {"role": "user", "content": f"Here is the SFDC lead data: {question}"},
+            {"role": "assistant", "content": answer}
+        ]
+        session['history'] = trim_history(session['history'], ASK_HISTORY_TOKEN_BUDGET * 2)  # bound session size
+        sessions.set(key, session)  # re-measure the session and refresh its TTL
+    return {'answer': answer, 'turns': len(session['history']) // 2}
+
+
+def session_stats():
+    """question counters and current session store size"""
+    with stats_lock:
+        current = dict(stats)
+    current['active_sessions'] = len(sessions)
+    current['session_bytes'] = sessions.bytes
+    return current
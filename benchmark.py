@@ -0,0 +1,216 @@
+import argparse
+import concurrent.futures
+import json
+import statistics
+import sys
+import threading
+import time
+import app
+import clientManager
+import completionCache
+import fakeBackends
+import generateSummary
+import rateLimit
+
+
+class RecordingClient:
+    """wraps the OpenAI client and records the usage of every chat completion"""
+
+    def __init__(self, client):
+        self.client = client
+        self.chat = self  # mimic client.chat.completions.create
+        self.completions = self
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def create(self, **kwargs):
+        completion = self.client.chat.completions.create(**kwargs)
+        with self.lock:
+            self.calls += 1
+            if getattr(completion, 'usage', None):
+                self.prompt_tokens += completion.usage.prompt_tokens
+                self.completion_tokens += completion.usage.completion_tokens
+        return completion
+
+
+def benchmark_generation(leadIDs, runs):
+    """compares OpenAI calls, tokens and latency per card for the sections and combined modes"""
+    recorder = RecordingClient(clientManager.get_openai_client())
+    clientManager.openai_client = recorder
+    completionCache.COMPLETION_CACHE_ENABLED = False  # every card must pay for its completions
+
+    modes = ["sections", "combined"]
+    results = {mode: {'latency': [], 'calls': [], 'prompt_tokens': [], 'completion_tokens': []} for mode in modes}
+    for leadID in leadIDs:
+        context = generateSummary.fetch_lead_context(leadID)  # SFDC data is fetched once per lead
+        if "error" in context["lead_data"] or "error" in context["campaign_history"]:
+            print(f"skipping {leadID}: no lead data or campaign history")
+            continue
+        for _ in range(runs):
+            for mode in modes:
+                recorder.reset()
+                start = time.perf_counter()
+                generateSummary.build_summary(context["lead_data"], context["campaign_history"],
+                                              context["duplicates"], mode=mode)
+                results[mode]['latency'].append(time.perf_counter() - start)
+                results[mode]['calls'].append(recorder.calls)
+                results[mode]['prompt_tokens'].append(recorder.prompt_tokens)
+                results[mode]['completion_tokens'].append(recorder.completion_tokens)
+
+    if not results["sections"]['latency']:
+        print("no cards generated")
+        return results
+
+    print(f"{'mode':<10}{'cards':>7}{'p50 s':>9}{'max s':>9}{'calls':>8}{'prompt tok':>12}{'completion tok':>16}")
+    for mode in modes:
+        result = results[mode]
+        print(f"{mode:<10}{len(result['latency']):>7}"
+              f"{statistics.median(result['latency']):>9.2f}{max(result['latency']):>9.2f}"
+              f"{statistics.mean(result['calls']):>8.2f}{statistics.mean(result['prompt_tokens']):>12.0f}"
+              f"{statistics.mean(result['completion_tokens']):>16.0f}")
+
+    sections, combined = results["sections"], results["combined"]
+    prompt_change = statistics.mean(combined['prompt_tokens']) / statistics.mean(sections['prompt_tokens']) - 1
+    latency_change = statistics.median(combined['latency']) / statistics.median(sections['latency']) - 1
+    print(f"combined vs sections: prompt tokens {prompt_change:+.0%}, median latency {latency_change:+.0%}")
+    return results
+
+
+def percentile(values, fraction):
+    """nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def lift_quotas():
+    """lets the fakes run unthrottled so the benchmark measures the pipeline, not the configured quotas"""
+    for limiter in (clientManager.openai_limiter, clientManager.sfdc_limiter):
+        limiter.requests = rateLimit.TokenBucket(1e9, 1e9)
+        limiter.tokens = None
+
+
+def benchmark_load(concurrency_levels, requests_per_level, sf, openai_server, mode=None):
+    """drives /query_lead against the fake SFDC and OpenAI backends at each concurrency level
+    (every request asks for a new lead, so each card is built from scratch)"""
+    completionCache.COMPLETION_CACHE_ENABLED = False  # every card must pay for its completions
+    fakeBackends.install(sf=sf, openai_server=openai_server)
+
+    def post(leadID):
+        start = time.perf_counter()
+        response = app.app.test_client().post('/query_lead', json={'lead_id': leadID, 'mode': mode})
+        ok = response.status_code == 200 and "error" not in response.get_json()
+        return time.perf_counter() - start, ok, ok and bool(response.get_json().get('pending'))
+
+    results = []
+    for level in concurrency_levels:
+        sf.calls = 0
+        openai_server.reset()
+        leadIDs = [f"00QLOAD{level:04d}{index:06d}" for index in range(requests_per_level)]
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=level) as pool:
+            outcomes = list(pool.map(post, leadIDs))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for latency, ok, _ in outcomes if ok]
+        cards = len(latencies)
+        per_card = max(1, cards)
+        results.append({
+            'concurrency': level,
+            'cards': cards,
+            'errors': len(outcomes) - cards,
+            'partial': sum(partial for _, _, partial in outcomes),  # returned with pending sections
+            'throughput': cards / elapsed,
+            'p50': percentile(latencies, 0.50) if latencies else None,
+            'p95': percentile(latencies, 0.95) if latencies else None,
+            'p99': percentile(latencies, 0.99) if latencies else None,
+            'sfdc_calls_per_card': sf.calls / per_card,
+            'openai_calls_per_card': openai_server.stats['requests'] / per_card,
+            'prompt_tokens_per_card': openai_server.stats['prompt_tokens'] / per_card,
+            'completion_tokens_per_card': openai_server.stats['completion_tokens'] / per_card
+        })
+
+    print(f"{'conc':>5}{'cards':>7}{'errors':>8}{'partial':>9}{'cards/s':>9}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}"
+          f"{'sfdc':>7}{'openai':>8}{'prompt tok':>12}{'completion tok':>16}")
+    for result in results:
+        latencies = [f"{result[name]:>8.2f}" if result[name] is not None else f"{'-':>8}"
+                     for name in ('p50', 'p95', 'p99')]
+        print(f"{result['concurrency']:>5}{result['cards']:>7}{result['errors']:>8}{result['partial']:>9}"
+              f"{result['throughput']:>9.2f}"
+              f"{''.join(latencies)}{result['sfdc_calls_per_card']:>7.2f}{result['openai_calls_per_card']:>8.2f}"
+              f"{result['prompt_tokens_per_card']:>12.0f}{result['completion_tokens_per_card']:>16.0f}")
+    return results
+
+
+def check_thresholds(results, args):
+    """CI gate: the failed thresholds (empty if the run is within them)"""
+    failures = []
+    for result in results:
+        level = f"concurrency {result['concurrency']}"
+        if result['errors'] > args.max_errors:
+            failures.append(f"{level}: {result['errors']} failed requests > {args.max_errors}")
+        if args.max_p95 is not None and (result['p95'] is None or result['p95'] > args.max_p95):
+            p95 = f"{result['p95']:.2f}" if result['p95'] is not None else "-"
+            failures.append(f"{level}: p95 {p95} s > {args.max_p95} s")
+        if args.min_throughput is not None and result['throughput'] < args.min_throughput:
+            failures.append(f"{level}: {result['throughput']:.2f} cards/s < {args.min_throughput}")
+        if args.max_openai_calls is not None and result['openai_calls_per_card'] > args.max_openai_calls:
+            failures.append(f"{level}: {result['openai_calls_per_card']:.2f} OpenAI calls per card > "
+                            f"{args.max_openai_calls}")
+        if args.max_sfdc_calls is not None and result['sfdc_calls_per_card'] > args.max_sfdc_calls:
+            failures.append(f"{level}: {result['sfdc_calls_per_card']:.2f} SFDC calls per card > {args.max_sfdc_calls}")
+        if args.max_prompt_tokens is not None and result['prompt_tokens_per_card'] > args.max_prompt_tokens:
+            failures.append(f"{level}: {result['prompt_tokens_per_card']:.0f} prompt tokens per card > "
+                            f"{args.max_prompt_tokens}")
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="battle card benchmarks")
+    subcommands = parser.add_subparsers(dest='benchmark', required=True)
+
+    generation = subcommands.add_parser('generation', help="compare per-section and combined generation")
+    generation.add_argument('lead_ids', nargs='+', help="SFDC lead IDs to generate cards for")
+    generation.add_argument('--runs', type=int, default=3, help="cards generated per lead and mode")
+
+    load = subcommands.add_parser('load', help="drive /query_lead against fake SFDC/ OpenAI backends (no network)")
+    load.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="concurrent requests per level")
+    load.add_argument('--requests', type=int, default=50, help="requests per concurrency level")
+    load.add_argument('--mode', choices=["sections", "combined"], help="generation mode (default from config)")
+    load.add_argument('--openai-latency', type=float, default=0.5, help="seconds per fake completion")
+    load.add_argument('--openai-error-rate', type=float, default=0.0, help="share of completions failing (429/ 500)")
+    load.add_argument('--completion-tokens', type=int, default=120, help="tokens per fake completion")
+    load.add_argument('--sfdc-latency', type=float, default=0.05, help="seconds per fake SOQL query")
+    load.add_argument('--sfdc-error-rate', type=float, default=0.0, help="share of SOQL queries failing (503)")
+    load.add_argument('--quotas', action='store_true', help="apply the configured OpenAI/ SFDC quotas")
+    load.add_argument('--json', help="write the results to this file")
+    # CI thresholds: the benchmark exits with status 1 when a level misses one
+    load.add_argument('--max-errors', type=int, default=0, help="failed requests allowed per level")
+    load.add_argument('--max-p95', type=float, help="max p95 latency in seconds")
+    load.add_argument('--min-throughput', type=float, help="min cards per second")
+    load.add_argument('--max-openai-calls', type=float, help="max OpenAI calls per card")
+    load.add_argument('--max-sfdc-calls', type=float, help="max SFDC calls per card")
+    load.add_argument('--max-prompt-tokens', type=float, help="max prompt tokens per card")
+
+    args = parser.parse_args()
+    if args.benchmark == 'generation':
+        benchmark_generation(args.lead_ids, args.runs)
+    elif args.benchmark == 'load':
+        if not args.quotas:
+            lift_quotas()
+        openai_server = fakeBackends.FakeOpenAIServer(latency=args.openai_latency, error_rate=args.openai_error_rate,
+                                                      completion_tokens=args.completion_tokens,
+                                                      json_keys=generateSummary.SECTIONS).start()
+        sf = fakeBackends.FakeSalesforce(latency=args.sfdc_latency, error_rate=args.sfdc_error_rate)
+        results = benchmark_load(args.concurrency, args.requests, sf, openai_server, mode=args.mode)
+        if args.json:
+            with open(args.json, 'w') as results_file:
+                json.dump(results, results_file, indent=2)
+        failures = check_thresholds(results, args)
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1 if failures else 0)
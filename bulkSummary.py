@@ -0,0 +1,195 @@
+import threading
+import time
+import uuid
+import concurrent.futures
+import config
+import clientManager
+import generateSummary
+import summaryCache
+from cacheStore import LRUCache
+from campaignCache import campaign_cache
+from soqlHelpers import CHUNK_SIZE, chunked, record_key, soql_list
+
+
+# bulk summary settings (override in config.py)
+BULK_MAX_LEADS = getattr(config, 'BULK_MAX_LEADS', 500)  # max lead IDs per job
+BULK_CHUNK_SIZE = getattr(config, 'BULK_CHUNK_SIZE', CHUNK_SIZE)  # IDs/ emails per IN (...) clause
+BULK_WORKERS = getattr(config, 'BULK_WORKERS', 4)  # cards generated concurrently per process
+BULK_MAX_JOBS = getattr(config, 'BULK_MAX_JOBS', 50)  # finished jobs kept for polling
+BULK_YIELD_POLL = 0.5  # seconds between checks while interactive OpenAI calls are waiting for quota
+
+bulk_pool = concurrent.futures.ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='bulk')
+# bulk sections get their own threads so a large job never fills the interactive section_pool;
+# OpenAI quota is shared with interactive requests through clientManager.openai_limiter
+bulk_section_pool = concurrent.futures.ThreadPoolExecutor(max_workers=BULK_WORKERS * generateSummary.SECTION_WORKERS,
+                                                          thread_name_prefix='bulk-section')
+
+jobs = LRUCache(BULK_MAX_JOBS)
+jobs_lock = threading.Lock()
+
+
+def query_leads_data(leadIDs):
+    """queries lead data for many leads with chunked Id IN (...) queries"""
+    fields = ", ".join(["Id", "SystemModstamp"] + generateSummary.LEAD_FIELDS)
+    leads = {}
+    for chunk in chunked(leadIDs, BULK_CHUNK_SIZE):
+        querySOQL = f"SELECT {fields} FROM Lead WHERE Id IN ({soql_list(chunk)})"
+        for record in clientManager.sf_query_all(querySOQL)['records']:
+            leads[record_key(record['Id'])] = record
+    campaign_cache.attach_leads(list(leads.values()))
+    return leads
+
+
+def query_campaign_histories(leadIDs):
+    """queries the 5 most recent campaigns for many leads with chunked LeadId IN (...) queries;
+    also returns each lead's latest CampaignMember change for the summary cache version"""
+    fields = f"LeadId, SystemModstamp, {generateSummary.CAMPAIGN_HISTORY_FIELDS}"
+    histories = {}
+    member_modstamps = {}
+    for chunk in chunked(leadIDs, BULK_CHUNK_SIZE):
+        querySOQL = (f"SELECT {fields} FROM CampaignMember WHERE LeadId IN ({soql_list(chunk)}) "
+                     "ORDER BY CreatedDate DESC")
+        for record in clientManager.sf_query_all(querySOQL)['records']:
+            key = record_key(record['LeadId'])
+            history = histories.setdefault(key, [])
+            if len(history) < 5:  # newest first, same as the single lead query
+                history.append(record)
+            member_modstamps[key] = max(member_modstamps.get(key, ''), record['SystemModstamp'])
+    campaign_cache.attach_history([record for history in histories.values() for record in history])
+    return histories, member_modstamps
+
+
+def query_duplicates_bulk(leads):
+    """resolves open duplicate leads and opportunities for every lead email in set-based queries
+    (or from the local email index when it is current)"""
+    if generateSummary.email_index.usable():
+        duplicates = {key: generateSummary.email_index.lookup(lead['Id'], lead.get('Email'))
+                      for key, lead in leads.items()}
+        if all(lead_duplicates is not None for lead_duplicates in duplicates.values()):
+            return duplicates
+
+    emails = sorted({lead['Email'] for lead in leads.values() if lead.get('Email')})
+    statuses = soql_list(generateSummary.OPEN_LEAD_STATUSES)
+    stages = soql_list(generateSummary.OPEN_OPPORTUNITY_STAGES)
+
+    leads_by_email = {}
+    opportunities_by_email = {}
+    for chunk in chunked(emails, BULK_CHUNK_SIZE):
+        queryLead = f"SELECT Id, Email FROM Lead WHERE Email IN ({soql_list(chunk)}) AND Status IN ({statuses})"
+        for record in clientManager.sf_query_all(queryLead)['records']:
+            leads_by_email.setdefault(record['Email'].lower(), []).append(record['Id'])
+
+        queryOpportunity = f"""
+            SELECT OpportunityId, Contact.Email
+            FROM OpportunityContactRole
+            WHERE Contact.Email IN ({soql_list(chunk)})
+            AND Opportunity.StageName IN ({stages})
+        """
+        for record in clientManager.sf_query_all(queryOpportunity)['records']:
+            email = (record.get('Contact') or {}).get('Email') or ''
+            opportunities = opportunities_by_email.setdefault(email.lower(), [])
+            if record['OpportunityId'] not in opportunities:
+                opportunities.append(record['OpportunityId'])
+
+    duplicates = {}
+    for key, lead in leads.items():
+        email = (lead.get('Email') or '').lower()
+        duplicates[key] = {
+            'Duplicate Leads': [leadID for leadID in leads_by_email.get(email, []) if leadID != lead['Id']],
+            'Duplicate Opportunities': opportunities_by_email.get(email, [])
+        }
+    return duplicates
+
+
+def wait_for_openai_headroom():
+    """bulk cards are lower priority: a new card only starts once no OpenAI calls are waiting for
+    quota, so interactive requests are admitted ahead of the job"""
+    while clientManager.openai_limiter.queued:
+        time.sleep(BULK_YIELD_POLL)
+
+
+def summarize_lead(leadID, lead_data, campaign_history, duplicates, version):
+    """builds (or reuses) one card of a bulk job"""
+    if not campaign_history:  # same error precedence as the single lead pipeline
+        return {"error": "no campaign history found"}
+    if lead_data is None:
+        return {"error": "no records found"}
+
+    summary = summaryCache.get_cached_summary(leadID, version, duplicates=duplicates)
+    if summary is not None:
+        return summary
+
+    wait_for_openai_headroom()
+    summary = generateSummary.build_summary(lead_data, campaign_history, duplicates, pool=bulk_section_pool)
+    if summaryCache.is_cacheable(summary):
+        summaryCache.store_summary(leadID, version, summary)
+    return summary
+
+
+def run_job(job, leadIDs):
+    """fetches SFDC data for all leads in bulk, then generates cards through the bulk worker pool"""
+    try:
+        job['status'] = 'fetching'
+        leads = query_leads_data(leadIDs)
+        histories, member_modstamps = query_campaign_histories(leadIDs)
+        duplicates = query_duplicates_bulk(leads)
+
+        job['status'] = 'summarizing'
+        futures = {}
+        for leadID in leadIDs:
+            key = record_key(leadID)
+            lead_data = leads.get(key)
+            version = summaryCache.format_version(lead_data and lead_data.get('SystemModstamp'),
+                                                  member_modstamps.get(key))
+            future = bulk_pool.submit(summarize_lead, leadID, lead_data, histories.get(key),
+                                      duplicates.get(key), version)
+            futures[future] = leadID
+
+        for future in concurrent.futures.as_completed(futures):  # results are published as they finish
+            try:
+                summary = future.result()
+            except Exception as card_error:
+                summary = {"error": str(card_error)}
+            with jobs_lock:
+                job['results'].append({'lead_id': futures[future], 'summary': summary})
+        job['status'] = 'complete'
+    except Exception as job_error:
+        job['status'] = 'failed'
+        job['error'] = str(job_error)
+    job['finished'] = time.time()
+
+
+def start_job(leadIDs):
+    """queues a bulk summary job and returns its ID for polling"""
+    leadIDs = list(dict.fromkeys(leadIDs))  # drop repeated IDs, keep order
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'status': 'queued',
+        'total': len(leadIDs),
+        'results': [],
+        'created': time.time()
+    }
+    jobs.set(job['job_id'], job)
+    threading.Thread(target=run_job, args=(job, leadIDs), daemon=True).start()
+    return {'job_id': job['job_id'], 'status': job['status'], 'total': job['total']}
+
+
+def get_job(job_id, since=0):
+    """returns job progress and the results completed after index `since` (None if unknown)"""
+    job = jobs.get(job_id)
+    if job is None:
+        return None
+    with jobs_lock:
+        results = job['results'][since:]
+        completed = len(job['results'])
+    response = {
+        'job_id': job_id,
+        'status': job['status'],
+        'total': job['total'],
+        'completed': completed,
+        'next': completed,  # pass as ?since= to only receive newer results
+        'results': results
+    }
+    if 'error' in job:
+        response['error'] = job['error']
+    return response
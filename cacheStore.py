@@ -0,0 +1,109 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """thread-safe in-memory cache that evicts the least recently used entry when full
+    (entries older than ttl seconds are treated as missing when ttl is set; with max_bytes the
+    cache also evicts until the total sizeof(value) fits, default size is the JSON length)"""
+
+    def __init__(self, max_size, ttl=None, max_bytes=None, sizeof=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: len(json.dumps(value, default=str)))
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """returns the cached value (or None) and marks it as recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            expires, value, size = self._entries[key]
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """stores a value, evicting the oldest entries past max_size (and max_bytes)"""
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(value) if self.max_bytes else 0
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires, value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_size or (self.max_bytes and self.bytes > self.max_bytes
+                                                         and len(self._entries) > 1):
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        # caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.bytes -= entry[2]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """persistent key/value tier backed by a SQLite file (survives process restarts and can be
+    shared by worker processes); entries older than ttl seconds are ignored when ttl is set, and
+    every PRUNE_INTERVAL writes the expired entries and the oldest ones past max_entries are deleted
+    (so the table can briefly hold up to PRUNE_INTERVAL extra rows)"""
+
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path, table, ttl=None, max_entries=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.writes = 0
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_created ON {table} (created)")
+
+    def _connect(self):
+        # one short-lived connection per call so the store can be shared across threads/ processes
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        """returns the stored JSON value or None"""
+        oldest = time.time() - self.ttl if self.ttl else 0
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ? AND created >= ?",
+                               (key, oldest)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value):
+        with self._lock:
+            self.writes += 1
+            prune = (self.ttl or self.max_entries) and self.writes % self.PRUNE_INTERVAL == 0
+        with self._connect() as conn:
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, created) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), time.time()))
+            if prune:
+                self._prune(conn)
+
+    def _prune(self, conn):
+        # both deletes are range scans on the created index
+        if self.ttl:
+            conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            conn.execute(f"DELETE FROM {self.table} WHERE created < "
+                         f"(SELECT created FROM {self.table} ORDER BY created DESC LIMIT 1 OFFSET ?)",
+                         (self.max_entries - 1,))
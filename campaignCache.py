@@ -0,0 +1,114 @@
+import threading
+import time
+import config
+import clientManager
+from soqlHelpers import CHUNK_SIZE, SYNC_OVERLAP, chunked, soql_datetime, soql_list
+
+
+# campaign cache settings (override in config.py)
+CAMPAIGN_CACHE_REFRESH = getattr(config, 'CAMPAIGN_CACHE_REFRESH', 300)  # seconds between incremental refreshes
+
+CAMPAIGN_FIELDS = ["Name", "Intended_Product__c", "CreatedDate", "Description"]
+
+
+class CampaignCache:
+    """Campaign metadata shared by all leads: campaigns are fetched by ID the first time a lead
+    references them and refreshed incrementally on SystemModstamp, so per-lead queries only select
+    campaign IDs; the whole Campaign table is only loaded for the product list"""
+
+    def __init__(self):
+        self.campaigns = {}  # campaign ID -> {field: value}
+        self.loaded = False  # every campaign is cached (needed by product_list)
+        self.watermark = None  # unix time the next refresh reads changes from
+        self.last_refresh = None
+        self.lock = threading.Lock()
+
+    def query_campaigns(self, condition=None):
+        fields = ", ".join(["Id"] + CAMPAIGN_FIELDS)
+        querySOQL = f"SELECT {fields} FROM Campaign" + (f" WHERE {condition}" if condition else "")
+        return {
+            record['Id']: {field: record.get(field) for field in CAMPAIGN_FIELDS}
+            for record in clientManager.sf_query_all(querySOQL)['records']
+        }
+
+    def start_sync(self, sync_start):
+        """the first fetch starts the incremental refresh window"""
+        if self.watermark is None:
+            self.watermark = sync_start - SYNC_OVERLAP
+            self.last_refresh = time.time()
+
+    def refresh(self):
+        """campaigns changed since the watermark"""
+        sync_start = time.time()
+        self.campaigns.update(self.query_campaigns(f"SystemModstamp >= {soql_datetime(self.watermark)}"))
+        self.watermark = sync_start - SYNC_OVERLAP
+        self.last_refresh = time.time()
+
+    def load_all(self):
+        """bulk load of every campaign"""
+        sync_start = time.time()
+        self.campaigns.update(self.query_campaigns())
+        self.loaded = True
+        self.watermark = None
+        self.start_sync(sync_start)
+
+    def ensure_fresh(self):
+        if self.watermark is None or time.time() - self.last_refresh < CAMPAIGN_CACHE_REFRESH:
+            return
+        if self.lock.acquire(blocking=False):  # one caller refreshes, the rest use current data
+            try:
+                self.refresh()
+            finally:
+                self.lock.release()
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            with self.lock:  # everyone waits for the bulk load
+                if not self.loaded:
+                    self.load_all()
+        self.ensure_fresh()
+
+    def get_many(self, campaignIDs):
+        """campaign metadata by ID, fetching campaigns that are not cached yet"""
+        self.ensure_fresh()
+        missing = sorted({campaignID for campaignID in campaignIDs if campaignID and campaignID not in self.campaigns})
+        sync_start = time.time()
+        for chunk in chunked(missing, CHUNK_SIZE):
+            self.campaigns.update(self.query_campaigns(f"Id IN ({soql_list(chunk)})"))
+        if missing:
+            self.start_sync(sync_start)
+        return {campaignID: self.campaigns.get(campaignID) for campaignID in campaignIDs if campaignID}
+
+    def attach_history(self, members):
+        """adds the Campaign relationship (Intended_Product__c, CreatedDate, Name) to CampaignMember records"""
+        campaigns = self.get_many([member.get('CampaignId') for member in members])
+        for member in members:
+            campaign = campaigns.get(member.get('CampaignId')) or {}
+            member['Campaign'] = {field: campaign.get(field)
+                                  for field in ["Intended_Product__c", "CreatedDate", "Name"]}
+        return members
+
+    def attach_leads(self, leads):
+        """adds the Most_Recent_Campaign__r relationship (Name, Intended_Product__c, Description) to Lead records"""
+        campaigns = self.get_many([lead.get('Most_Recent_Campaign__c') for lead in leads])
+        for lead in leads:
+            campaign = campaigns.get(lead.get('Most_Recent_Campaign__c')) or {}
+            lead['Most_Recent_Campaign__r'] = {field: campaign.get(field)
+                                               for field in ["Name", "Intended_Product__c", "Description"]}
+        return leads
+
+    def product_list(self):
+        """distinct Intended_Product__c values across all campaigns"""
+        self.ensure_loaded()
+        return sorted({campaign['Intended_Product__c'] for campaign in list(self.campaigns.values())
+                       if campaign.get('Intended_Product__c')})
+
+    def status(self):
+        return {
+            'campaigns': len(self.campaigns),
+            'fully_loaded': self.loaded,
+            'seconds_since_refresh': None if self.last_refresh is None else round(time.time() - self.last_refresh, 1)
+        }
+
+
+campaign_cache = CampaignCache()
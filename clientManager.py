@@ -0,0 +1,273 @@
+import json
+import os
+import threading
+import time
+import httpx
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+from simple_salesforce import Salesforce, SalesforceLogin
+from simple_salesforce.exceptions import SalesforceError, SalesforceExpiredSession
+import config
+import metrics
+import promptTemplates
+import rateLimit
+
+
+# client settings (override in config.py)
+HTTP_POOL_SIZE = getattr(config, 'HTTP_POOL_SIZE', 10)  # keep-alive connections per client
+OPENAI_TIMEOUT = getattr(config, 'SECTION_TIMEOUT', 30)  # seconds before an OpenAI call is abandoned
+SFDC_SESSION_CACHE_PATH = getattr(config, 'SFDC_SESSION_CACHE_PATH', None)  # e.g. /tmp/sfdc_session.json
+LOGIN_FILE = 'virtual_env/login.json'
+
+# upstream quotas (override in config.py): calls wait for headroom, up to *_MAX_QUEUE at a time
+OPENAI_RPM = getattr(config, 'OPENAI_RPM', 500)  # OpenAI requests per minute
+OPENAI_TPM = getattr(config, 'OPENAI_TPM', 160000)  # OpenAI tokens per minute (prompt + completion)
+OPENAI_COMPLETION_TOKENS = getattr(config, 'OPENAI_COMPLETION_TOKENS', 300)  # expected tokens per completion
+OPENAI_MAX_QUEUE = getattr(config, 'OPENAI_MAX_QUEUE', 100)
+SFDC_DAILY_API_CALLS = getattr(config, 'SFDC_DAILY_API_CALLS', 100000)  # org's 24 hour API request allocation
+SFDC_MAX_CONCURRENT = getattr(config, 'SFDC_MAX_CONCURRENT', 20)  # SFDC caps concurrent long-running requests
+SFDC_MAX_QUEUE = getattr(config, 'SFDC_MAX_QUEUE', 100)
+SFDC_RETRY_WINDOW = getattr(config, 'SFDC_RETRY_WINDOW', 30)  # max seconds a SFDC call waits and retries
+SFDC_LIMIT_RETRY_AFTER = getattr(config, 'SFDC_LIMIT_RETRY_AFTER', 3600)  # Retry-After once the daily limit is hit
+
+# buckets allow a burst of 10 seconds of OpenAI quota and one hour of the daily SFDC allocation
+openai_limiter = rateLimit.Limiter('openai', rateLimit.TokenBucket(OPENAI_RPM / 60, max(1, OPENAI_RPM / 6)),
+                                   tokens=rateLimit.TokenBucket(OPENAI_TPM / 60, OPENAI_TPM / 6),
+                                   max_queue=OPENAI_MAX_QUEUE)
+sfdc_limiter = rateLimit.Limiter('sfdc', rateLimit.TokenBucket(SFDC_DAILY_API_CALLS / 86400, SFDC_DAILY_API_CALLS / 24),
+                                 max_concurrent=SFDC_MAX_CONCURRENT, max_queue=SFDC_MAX_QUEUE)
+
+lock = threading.Lock()
+sf_client = None
+openai_client = None
+
+# connection timings: cold = call that had to connect first, warm = reused client
+stats = {
+    'sfdc_logins': 0,
+    'sfdc_session_refreshes': 0,
+    'sfdc_connect_source': None,
+    'sfdc_connect_ms': None,
+    'openai_connect_ms': None,
+    'cold_calls': 0,
+    'cold_ms': 0.0,
+    'warm_calls': 0,
+    'warm_ms': 0.0
+}
+
+
+def load_credentials():
+    """SFDC credentials from environment variables (Vercel) when set, otherwise from
+    virtual_env/login.json (local); an empty or unreadable login file is skipped"""
+    username = os.getenv('SFDC_USERNAME')
+    password = os.getenv('SFDC_PW')
+    security_token = os.getenv('SFDC_SECURITY_TOKEN')
+    if not all([username, password, security_token]) and os.path.exists(LOGIN_FILE):
+        try:
+            with open(LOGIN_FILE) as login_file:
+                loginInfo = json.load(login_file)
+            username = loginInfo['username']
+            password = loginInfo['password']
+            security_token = loginInfo['security_token']
+        except (ValueError, KeyError, TypeError, OSError):  # e.g. the empty placeholder file
+            pass
+    if not all([username, password, security_token]):
+        raise ValueError("Salesforce credentials are not fully set. Please check login.json or environment variables.")
+    return username, password, security_token
+
+
+def new_http_session():
+    """requests session with a keep-alive connection pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    return session
+
+
+def load_cached_session():
+    """session ID and instance saved by a previous process (None if unavailable)"""
+    if not SFDC_SESSION_CACHE_PATH or not os.path.exists(SFDC_SESSION_CACHE_PATH):
+        return None
+    try:
+        with open(SFDC_SESSION_CACHE_PATH) as session_file:
+            cached = json.load(session_file)
+        return cached['session_id'], cached['instance']
+    except (ValueError, KeyError, OSError):
+        return None
+
+
+def save_cached_session(session_id, instance):
+    if not SFDC_SESSION_CACHE_PATH:
+        return
+    # session file is private to this user since it holds a live token
+    fd = os.open(SFDC_SESSION_CACHE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as session_file:
+        json.dump({'session_id': session_id, 'instance': instance}, session_file)
+
+
+def connect_sf(force_login=False):
+    """connects to Salesforce, reusing a cached session token unless force_login is set"""
+    start = time.perf_counter()
+    session = new_http_session()
+    cached = None if force_login else load_cached_session()
+    if cached:
+        session_id, instance = cached
+        stats['sfdc_connect_source'] = 'cached session'
+    else:
+        username, password, security_token = load_credentials()
+        metrics.sfdc_calls.inc(method='login')
+        # connect to Salesforce securely (no risk of username, pw, token exposure)
+        session_id, instance = SalesforceLogin(username=username,
+                                               password=password,
+                                               security_token=security_token,
+                                               domain='login',
+                                               session=session)
+        save_cached_session(session_id, instance)
+        stats['sfdc_logins'] += 1
+        stats['sfdc_connect_source'] = 'login'
+    client = Salesforce(instance=instance, session_id=session_id, session=session)
+    stats['sfdc_connect_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return client
+
+
+def get_sf():
+    """shared Salesforce client, connected on first use"""
+    global sf_client
+    if sf_client is None:
+        with lock:
+            if sf_client is None:
+                sf_client = connect_sf()
+    return sf_client
+
+
+def refresh_sf(stale_client):
+    """logs in again after the session expired (once, even if several threads noticed)"""
+    global sf_client
+    with lock:
+        if sf_client is stale_client:
+            sf_client = connect_sf(force_login=True)
+            stats['sfdc_session_refreshes'] += 1
+    return sf_client
+
+
+def record_call(cold, start):
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    with lock:
+        if cold:
+            stats['cold_calls'] += 1
+            stats['cold_ms'] += elapsed_ms
+        else:
+            stats['warm_calls'] += 1
+            stats['warm_ms'] += elapsed_ms
+
+
+def sf_retry_after(error):
+    """retry delay hint for SFDC errors worth retrying (None for anything else)"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return 0
+    if not isinstance(error, SalesforceError):
+        return None
+    if error.status == 429 or error.status >= 500:
+        return 0
+    return None
+
+
+def is_request_limit_exceeded(error):
+    """the org's rolling 24 hour API allocation is used up (backing off for seconds will not help)"""
+    return isinstance(error, SalesforceError) and 'REQUEST_LIMIT_EXCEEDED' in str(error.content)
+
+
+def sf_call(method, *args, **kwargs):
+    """runs a Salesforce client method under the SFDC limits (retrying throttled and 5xx responses
+    until the request deadline), re-authenticating once on INVALID_SESSION_ID; an exhausted daily
+    API allocation raises rateLimit.Throttled at once"""
+    def call():
+        nonlocal cold
+        client = get_sf()
+        metrics.sfdc_calls.inc(method=method)
+        metrics.record_count('sfdc-calls')
+        with metrics.timer(metrics.sfdc_seconds, method=method):
+            try:
+                return getattr(client, method)(*args, **kwargs)
+            except SalesforceExpiredSession:
+                cold = True
+                metrics.sfdc_calls.inc(method=method)
+                metrics.record_count('sfdc-calls')
+                return getattr(refresh_sf(client), method)(*args, **kwargs)
+            except SalesforceError as sf_error:
+                if not is_request_limit_exceeded(sf_error):
+                    raise
+                sfdc_limiter.count('rejected')
+                raise rateLimit.Throttled("sfdc daily API request limit exceeded",
+                                          retry_after=SFDC_LIMIT_RETRY_AFTER) from sf_error
+
+    start = time.perf_counter()
+    cold = sf_client is None
+    result = rateLimit.call_with_retry(sfdc_limiter, call, rateLimit.deadline(SFDC_RETRY_WINDOW), sf_retry_after)
+    record_call(cold, start)
+    return result
+
+
+def sf_query(querySOQL):
+    return sf_call('query', querySOQL)
+
+
+def sf_query_all(querySOQL, include_deleted=False):
+    """queries every page of results (include_deleted also returns records in the recycle bin)"""
+    return sf_call('query_all', querySOQL, include_deleted=include_deleted)
+
+
+def get_openai_client():
+    """shared OpenAI client with a keep-alive connection pool, created on first use"""
+    global openai_client
+    if openai_client is None:
+        with lock:
+            if openai_client is None:
+                start = time.perf_counter()
+                api_key = getattr(config, 'OPENAI_API_KEY', None) or os.getenv('OPENAI_API_KEY')
+                limits = httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE)
+                # retries are handled by openai_create so they respect the limiter and request deadline
+                openai_client = openai.OpenAI(api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=0,
+                                              http_client=httpx.Client(limits=limits, timeout=OPENAI_TIMEOUT))
+                stats['openai_connect_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return openai_client
+
+
+def openai_retry_after(error):
+    """retry delay for OpenAI rate limit, 5xx and connection errors (None for anything else;
+    an exhausted quota is not retried)"""
+    if isinstance(error, openai.RateLimitError):
+        if getattr(error, 'code', None) == 'insufficient_quota':
+            return None
+        try:
+            return float(error.response.headers.get('retry-after') or 0)
+        except ValueError:
+            return 0
+    if isinstance(error, (openai.InternalServerError, openai.APIConnectionError)):
+        return 0
+    return None
+
+
+def openai_create(openai_client, prompt_tokens=None, **options):
+    """chat completion under the OpenAI request/ token limits, retried on 429/5xx with jittered
+    backoff until the request deadline (raises rateLimit.Throttled when it cannot be served in time);
+    prompt_tokens is counted from the messages unless the caller already did"""
+    if prompt_tokens is None:
+        prompt_tokens = promptTemplates.count_message_tokens(options['messages'])
+    return rateLimit.call_with_retry(openai_limiter, lambda: openai_client.chat.completions.create(**options),
+                                     rateLimit.deadline(OPENAI_TIMEOUT), openai_retry_after,
+                                     tokens=prompt_tokens + OPENAI_COMPLETION_TOKENS)
+
+
+def client_status():
+    """connection state and cold versus warm SFDC call timings"""
+    with lock:
+        current = dict(stats)
+    current['sfdc_connected'] = sf_client is not None
+    current['openai_connected'] = openai_client is not None
+    for kind in ['cold', 'warm']:
+        total_ms = current.pop(f'{kind}_ms')
+        calls = current[f'{kind}_calls']
+        current[f'{kind}_avg_ms'] = round(total_ms / calls, 1) if calls else None
+    current['limits'] = {'openai': openai_limiter.status(), 'sfdc': sfdc_limiter.status()}
+    return current
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import threading
+import config
+from cacheStore import LRUCache, SQLiteStore
+
+
+# completion cache settings (override in config.py)
+COMPLETION_CACHE_ENABLED = getattr(config, 'COMPLETION_CACHE_ENABLED', True)
+COMPLETION_CACHE_SIZE = getattr(config, 'COMPLETION_CACHE_SIZE', 1024)  # completions kept in memory
+COMPLETION_CACHE_TTL = getattr(config, 'COMPLETION_CACHE_TTL', 24 * 60 * 60)  # seconds a completion is reused
+COMPLETION_CACHE_PATH = getattr(config, 'COMPLETION_CACHE_PATH', None)  # SQLite file shared by worker processes
+
+memory_cache = LRUCache(COMPLETION_CACHE_SIZE, ttl=COMPLETION_CACHE_TTL)
+disk_cache = None
+if COMPLETION_CACHE_PATH:
+    disk_cache = SQLiteStore(COMPLETION_CACHE_PATH, 'completions', ttl=COMPLETION_CACHE_TTL)
+
+section_stats = {}  # section title -> {'hits': n, 'misses': n}
+stats_lock = threading.Lock()
+
+
+def completion_key(model, system_prompt, user_prompt, response_format=None, history=None):
+    """content address of a completion request (temperature 0 makes the response reusable)"""
+    request = json.dumps([model, system_prompt, user_prompt, response_format, history or []], sort_keys=True)
+    return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+
+def count(section, stat):
+    with stats_lock:
+        counters = section_stats.setdefault(section or 'Other', {'hits': 0, 'misses': 0})
+        counters[stat] += 1
+
+
+def get_completion(key, section=None):
+    """cached completion for the key (None on a miss), counted under the section title"""
+    if not COMPLETION_CACHE_ENABLED:
+        return None
+    content = memory_cache.get(key)
+    if content is None and disk_cache:
+        content = disk_cache.get(key)
+        if content is not None:
+            memory_cache.set(key, content)  # promote to memory tier
+    count(section, 'hits' if content is not None else 'misses')
+    return content
+
+
+def store_completion(key, content):
+    if not COMPLETION_CACHE_ENABLED:
+        return
+    memory_cache.set(key, content)
+    if disk_cache:
+        disk_cache.set(key, content)
+
+
+def cache_stats():
+    """hit/miss counters and hit rate per section title"""
+    with stats_lock:
+        current = {section: dict(counters) for section, counters in section_stats.items()}
+    for counters in current.values():
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else None
+    return {
+        'enabled': COMPLETION_CACHE_ENABLED,
+        'memory_entries': len(memory_cache),
+        'disk_enabled': disk_cache is not None,
+        'sections': current
+    }
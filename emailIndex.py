@@ -0,0 +1,174 @@
+import threading
+import time
+import config
+import clientManager
+from soqlHelpers import CHUNK_SIZE, SYNC_OVERLAP, chunked, record_key, soql_datetime, soql_list
+
+
+# email index settings (override in config.py)
+EMAIL_INDEX_ENABLED = getattr(config, 'EMAIL_INDEX_ENABLED', False)  # bootstrapping scans all open leads/ opps
+EMAIL_INDEX_SYNC_INTERVAL = getattr(config, 'EMAIL_INDEX_SYNC_INTERVAL', 60)  # seconds between incremental syncs
+EMAIL_INDEX_MAX_STALENESS = getattr(config, 'EMAIL_INDEX_MAX_STALENESS', 300)  # older index falls back to SOQL
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class EmailIndex:
+    """local map of normalized email -> open duplicate leads and opportunities, bootstrapped once
+    and kept current by incremental SystemModstamp syncs on a background thread"""
+
+    def __init__(self, lead_statuses, opportunity_stages):
+        self.open_lead_statuses = set(lead_statuses)
+        self.lead_statuses = soql_list(lead_statuses)
+        self.opportunity_stages = soql_list(opportunity_stages)
+        self.leads_by_email = {}  # email -> {lead ID}
+        self.lead_emails = {}  # lead ID -> email (IDs as returned by SFDC)
+        self.opportunities_by_email = {}  # email -> {opportunity ID}
+        self.opportunity_emails = {}  # opportunity ID -> {email}
+        self.watermark = None  # unix time the next sync reads changes from
+        self.last_sync = None
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # index maintenance (callers hold self.lock)
+
+    def _set_lead(self, leadID, email):
+        old_email = self.lead_emails.pop(leadID, None)
+        if old_email:
+            self.leads_by_email.get(old_email, set()).discard(leadID)
+        if email:
+            self.lead_emails[leadID] = email
+            self.leads_by_email.setdefault(email, set()).add(leadID)
+
+    def _set_opportunity(self, opportunityID, emails):
+        for old_email in self.opportunity_emails.pop(opportunityID, set()):
+            self.opportunities_by_email.get(old_email, set()).discard(opportunityID)
+        if emails:
+            self.opportunity_emails[opportunityID] = set(emails)
+            for email in emails:
+                self.opportunities_by_email.setdefault(email, set()).add(opportunityID)
+
+    # SFDC queries
+
+    def query_open_opportunity_emails(self, condition):
+        """opportunity ID -> emails of its contact roles, for open opportunities matching condition"""
+        querySOQL = f"""
+            SELECT OpportunityId, Contact.Email
+            FROM OpportunityContactRole
+            WHERE {condition}
+            AND Contact.Email != null
+            AND Opportunity.StageName IN ({self.opportunity_stages})
+        """
+        emails = {}
+        for record in clientManager.sf_query_all(querySOQL)['records']:
+            email = normalize_email((record.get('Contact') or {}).get('Email'))
+            emails.setdefault(record['OpportunityId'], set()).add(email)
+        return emails
+
+    def bootstrap(self):
+        """loads every open lead and opportunity email"""
+        sync_start = time.time()
+        leads = clientManager.sf_query_all(
+            f"SELECT Id, Email FROM Lead WHERE Email != null AND Status IN ({self.lead_statuses})")['records']
+        opportunities = self.query_open_opportunity_emails("OpportunityId != null")
+        with self.lock:
+            self.leads_by_email, self.lead_emails = {}, {}
+            self.opportunities_by_email, self.opportunity_emails = {}, {}
+            for record in leads:
+                self._set_lead(record['Id'], normalize_email(record['Email']))
+            for opportunityID, emails in opportunities.items():
+                self._set_opportunity(opportunityID, emails)
+            self.watermark = sync_start - SYNC_OVERLAP
+            self.last_sync = time.time()
+
+    def sync(self):
+        """applies lead, opportunity, contact role and contact changes since the watermark"""
+        sync_start = time.time()
+        since = soql_datetime(self.watermark)
+
+        # leads: re-evaluate every changed or deleted lead
+        leads = clientManager.sf_query_all(
+            f"SELECT Id, Email, Status, IsDeleted FROM Lead WHERE SystemModstamp >= {since}",
+            include_deleted=True)['records']
+
+        # opportunities: changed stages, changed/ deleted contact roles and changed contact emails
+        changed = {record['Id'] for record in clientManager.sf_query_all(
+            f"SELECT Id FROM Opportunity WHERE SystemModstamp >= {since}", include_deleted=True)['records']}
+        changed |= {record['OpportunityId'] for record in clientManager.sf_query_all(
+            f"SELECT OpportunityId FROM OpportunityContactRole WHERE SystemModstamp >= {since}",
+            include_deleted=True)['records']}
+        contactIDs = [record['Id'] for record in clientManager.sf_query_all(
+            f"SELECT Id FROM Contact WHERE SystemModstamp >= {since}")['records']]
+        for chunk in chunked(contactIDs, CHUNK_SIZE):
+            querySOQL = f"SELECT OpportunityId FROM OpportunityContactRole WHERE ContactId IN ({soql_list(chunk)})"
+            changed |= {record['OpportunityId'] for record in clientManager.sf_query_all(querySOQL)['records']}
+        opportunities = {}
+        for chunk in chunked(sorted(changed), CHUNK_SIZE):
+            opportunities.update(self.query_open_opportunity_emails(f"OpportunityId IN ({soql_list(chunk)})"))
+
+        with self.lock:
+            for record in leads:
+                is_open = not record.get('IsDeleted') and record['Status'] in self.open_lead_statuses
+                self._set_lead(record['Id'], normalize_email(record['Email']) if is_open else None)
+            for opportunityID in changed:  # closed or deleted opportunities drop out of the index
+                self._set_opportunity(opportunityID, opportunities.get(opportunityID))
+            self.watermark = sync_start - SYNC_OVERLAP
+            self.last_sync = time.time()
+
+    def run(self):
+        """background loop: bootstrap, then sync every EMAIL_INDEX_SYNC_INTERVAL seconds"""
+        while True:
+            try:
+                if self.watermark is None:
+                    self.bootstrap()
+                else:
+                    self.sync()
+                self.last_error = None
+            except Exception as sync_error:  # keep serving the last good index; staleness grows
+                self.last_error = str(sync_error)
+            time.sleep(EMAIL_INDEX_SYNC_INTERVAL)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='email-index', daemon=True)
+            self.thread.start()
+
+    def staleness(self):
+        """seconds since the last successful sync (None before the bootstrap finished)"""
+        return None if self.last_sync is None else time.time() - self.last_sync
+
+    def usable(self):
+        staleness = self.staleness()
+        return staleness is not None and staleness <= EMAIL_INDEX_MAX_STALENESS
+
+    def lookup(self, leadID, email):
+        """open duplicates for the email in the query_duplicates format,
+        or None when the index is not bootstrapped or too stale to trust"""
+        if not self.usable():
+            return None
+        email = normalize_email(email)
+        with self.lock:
+            leads = sorted(duplicate for duplicate in self.leads_by_email.get(email, set())
+                           if record_key(duplicate) != record_key(leadID or ''))
+            opportunities = sorted(self.opportunities_by_email.get(email, set()))
+        return {
+            'Duplicate Leads': leads,
+            'Duplicate Opportunities': opportunities
+        }
+
+    def status(self):
+        staleness = self.staleness()
+        with self.lock:
+            return {
+                'enabled': self.thread is not None,
+                'ready': self.last_sync is not None,
+                'usable': self.usable(),
+                'staleness_seconds': None if staleness is None else round(staleness, 1),
+                'max_staleness_seconds': EMAIL_INDEX_MAX_STALENESS,
+                'lead_emails': len(self.lead_emails),
+                'opportunities': len(self.opportunity_emails),
+                'last_error': self.last_error
+            }
@@ -0,0 +1,248 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import openai
+from simple_salesforce.exceptions import SalesforceGeneralError
+import clientManager
+
+
+PRODUCTS = ["RingEX", "RingCX", "RingCentral Video", "RingCentral Events", "RingCentral Contact Center"]
+MODSTAMP = "2024-01-01T00:00:00.000+0000"
+
+
+def field_list(soql):
+    """top level fields of a SELECT (subqueries dropped)"""
+    select = re.search(r"SELECT\s+(.*?)\s+FROM\s+\w+\s*(WHERE|ORDER|LIMIT|$)", re.sub(r"\(.*?\)", "", soql, flags=re.S),
+                       re.S | re.I).group(1)
+    return [field.strip() for field in select.split(",") if field.strip()]
+
+
+def quoted(soql, field):
+    """value compared to `field` in the WHERE clause (None if absent)"""
+    match = re.search(rf"\b{re.escape(field)}\s*=\s*'([^']*)'", soql)
+    return match.group(1) if match else None
+
+
+def in_list(soql, field):
+    """values of a literal `field` IN (...) list in the WHERE clause (None if absent or a subquery)"""
+    match = re.search(rf"\b{re.escape(field)}\s+IN\s*\(([^()]*)\)", soql)
+    if not match or re.search(r"\bSELECT\b", match.group(1), re.I):
+        return None
+    return re.findall(r"'((?:[^'\\]|\\.)*)'", match.group(1))
+
+
+def matching(soql, field):
+    """values `field` is compared to, as an = or IN (...) condition"""
+    values = in_list(soql, field)
+    if values is not None:
+        return values
+    value = quoted(soql, field)
+    return [value] if value else []
+
+
+class FakeSalesforce:
+    """in-process stand-in for simple_salesforce.Salesforce: answers the SOQL shapes the battle card
+    issues (lead data, campaign history, version probe, duplicates, campaigns) with deterministic
+    records synthesized from the IDs in the query; latency and error_rate apply per call"""
+
+    def __init__(self, latency=0.05, error_rate=0.0, campaigns=50, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.campaigns = [
+            {'Id': f"701{index:012d}", 'Name': f"Campaign {index}",
+             'Intended_Product__c': PRODUCTS[index % len(PRODUCTS)], 'CreatedDate': MODSTAMP,
+             'Description': f"Webinar and nurture campaign {index}", 'SystemModstamp': MODSTAMP}
+            for index in range(campaigns)
+        ]
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def query(self, soql, **kwargs):
+        with self.lock:
+            self.calls += 1
+            fail = self.random.random() < self.error_rate
+        time.sleep(self.latency)
+        if fail:
+            raise SalesforceGeneralError('https://fake.salesforce.com/query', 503, 'query',
+                                         [{'errorCode': 'SERVER_UNAVAILABLE'}])
+        records = self.records(soql)
+        return {'totalSize': len(records), 'done': True, 'records': records}
+
+    def query_all(self, soql, include_deleted=False, **kwargs):
+        return self.query(soql)
+
+    def records(self, soql):
+        """dispatches on the SOQL shape, filtering on the Id/ LeadId/ Email IN (...) lists and
+        SystemModstamp conditions the code sends; unrecognised queries return no records"""
+        leadID = quoted(soql, "Id")
+        if "FROM CampaignMembers" in soql and leadID:  # version probe
+            return [{'SystemModstamp': MODSTAMP, 'CampaignMembers': {'records': [{'SystemModstamp': MODSTAMP}]}}]
+        if re.search(r"FROM Lead\s+WHERE Email", soql):  # duplicate leads (single lead or bulk)
+            return [{'Id': f"00Q{zlib.crc32(email.encode()):012d}", 'Email': email}
+                    for email in matching(soql, "Email") if "+dup" in email]
+        if re.search(r"FROM Opportunity\s+WHERE", soql):  # duplicate opportunities of one email
+            return [{'Id': "006000000000001"}] if "+dup" in soql else []
+        if re.search(r"FROM OpportunityContactRole\s+WHERE", soql):  # duplicate opportunities in bulk
+            return [{'OpportunityId': "006000000000001", 'Contact': {'Email': email}}
+                    for email in matching(soql, "Contact.Email") if "+dup" in email]
+        if re.search(r"FROM Lead\s+WHERE Id", soql):
+            return [self.lead(lead, field_list(soql)) for lead in matching(soql, "Id")]
+        if "FROM CampaignMember" in soql:
+            return [member for lead in matching(soql, "LeadId") for member in self.campaign_members(lead)]
+        if re.search(r"FROM Campaign\b", soql):
+            campaigns = self.campaigns
+            campaignIDs = in_list(soql, "Id")
+            if campaignIDs is not None:
+                campaigns = [campaign for campaign in campaigns if campaign['Id'] in campaignIDs]
+            since = re.search(r"SystemModstamp\s*>=\s*(\S+)", soql)
+            if since:  # incremental refresh: the fake campaigns never change after MODSTAMP
+                campaigns = [campaign for campaign in campaigns
+                             if campaign['SystemModstamp'][:19] >= since.group(1)[:19]]
+            return [{field: campaign.get(field) for field in field_list(soql)} for campaign in campaigns]
+        return []
+
+    def lead(self, leadID, fields):
+        seed = zlib.crc32(leadID.encode())
+        values = {
+            'Id': leadID,
+            'Name': f"Lead {seed % 10000}",
+            'Company': f"Company {seed % 997}",
+            'Title': "Director of IT",
+            'Email': f"lead{seed}{'+dup' if seed % 5 == 0 else ''}@example.com",  # every 5th lead has duplicates
+            'Status': "1. New",
+            'NumberOfEmployees__c': seed % 5000,
+            'SM_Employees__c': seed % 5000,
+            'Description': "Inbound demo request about replacing an on-premise phone system. " * 3,
+            'Notes__c': "Asked about contact center pricing and Microsoft Teams integration.",
+            'Most_Recent_Campaign__c': self.campaigns[seed % len(self.campaigns)]['Id'],
+            'SystemModstamp': MODSTAMP
+        }
+        record = {}
+        for field in fields:
+            if "." in field:  # relationship field, e.g. SegmentName__r.Name
+                relationship, name = field.split(".", 1)
+                record.setdefault(relationship, {})[name] = f"{relationship[:-3]} {seed % 7}"
+            else:
+                record[field] = values.get(field, f"{field} {seed % 100}")
+        return record
+
+    def campaign_members(self, leadID):
+        seed = zlib.crc32(leadID.encode())
+        return [{'LeadId': leadID, 'CampaignId': self.campaigns[(seed + offset) % len(self.campaigns)]['Id'],
+                 'CreatedDate': MODSTAMP, 'SystemModstamp': MODSTAMP}
+                for offset in range(5)]
+
+
+class FakeOpenAIServer:
+    """local chat-completions endpoint (OpenAI wire format, streaming included) with configurable
+    latency, error rate (alternating 429 and 500 responses) and completion length; prompt tokens are
+    estimated as characters / 4, json_keys fills JSON-mode responses"""
+
+    def __init__(self, latency=0.5, error_rate=0.0, completion_tokens=120, json_keys=(), seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+        self.json_keys = list(json_keys)
+        self.random = random.Random(seed)
+        self.stats = {'requests': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='fake-openai').start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def reset(self):
+        with self.lock:
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def completion(self, request):
+        """response body for a chat completion request"""
+        prompt_tokens = sum(len(message.get('content') or '') for message in request['messages']) // 4
+        text = " ".join(["insight"] * self.completion_tokens)
+        if (request.get('response_format') or {}).get('type') == 'json_object':
+            text = json.dumps({key: " ".join(["insight"] * (self.completion_tokens // max(1, len(self.json_keys))))
+                               for key in self.json_keys})
+        with self.lock:
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['completion_tokens'] += self.completion_tokens
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': self.completion_tokens,
+                 'total_tokens': prompt_tokens + self.completion_tokens}
+        return text, usage
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.stats['requests'] += 1
+                    fail = fake.random.random() < fake.error_rate
+                    if fail:
+                        fake.stats['errors'] += 1
+                        status = 429 if fake.stats['errors'] % 2 else 500
+                time.sleep(fake.latency)
+                if fail:
+                    return self.send_json(status, {'error': {'message': 'fake failure', 'type': 'fake', 'code': None}},
+                                          {'retry-after': '0.1'} if status == 429 else None)
+
+                text, usage = fake.completion(request)
+                base = {'id': 'chatcmpl-fake', 'created': int(time.time()), 'model': request['model']}
+                if not request.get('stream'):
+                    return self.send_json(200, dict(base, object='chat.completion', usage=usage, choices=[
+                        {'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': text}}]))
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                chunks = [dict(base, object='chat.completion.chunk', choices=[
+                    {'index': 0, 'finish_reason': None, 'delta': {'content': word + " "}}]) for word in text.split(" ")]
+                if (request.get('stream_options') or {}).get('include_usage'):
+                    chunks.append(dict(base, object='chat.completion.chunk', choices=[], usage=usage))
+                for chunk in chunks:
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
+
+
+def install(sf=None, openai_server=None):
+    """points clientManager's shared clients at the fakes (no credentials or network needed)"""
+    if sf is not None:
+        clientManager.sf_client = sf
+    if openai_server is not None:
+        limits = httpx.Limits(max_connections=clientManager.HTTP_POOL_SIZE,
+                              max_keepalive_connections=clientManager.HTTP_POOL_SIZE)
+        clientManager.openai_client = openai.OpenAI(api_key='fake', base_url=openai_server.base_url, max_retries=0,
+                                                    timeout=clientManager.OPENAI_TIMEOUT,
+                                                    http_client=httpx.Client(limits=limits,
+                                                                             timeout=clientManager.OPENAI_TIMEOUT))
@@ -1,67 +1,224 @@
 import json
-import openai
-from simple_salesforce import Salesforce, SalesforceLogin
-from config import OPENAI_API_KEY
-
-
-# configure login information: LOCAL
-loginInfo = json.load(open('virtual_env/login.json'))
-username = loginInfo['username']
-password = loginInfo['password']
-security_token = loginInfo['security_token']
-domain = 'login'
-
-# # configure login information: VERCEL DEPLOYMENT
-# username = os.getenv('SFDC_USERNAME')
-# password = os.getenv('SFDC_PW')
-# security_token = os.getenv('SFDC_SECURITY_TOKEN')
-# domain = 'login'
-# if not all([username, password, security_token]):
-#     raise ValueError("Salesforce credentials are not fully set. Please check environment variables.")
-
-# connect to Salesforce securely (no risk of username, pw, token exposure)
-session_id, instance = SalesforceLogin(username=username,
-                                       password=password,
-                                       security_token=security_token,
-                                       domain=domain)
-sf = Salesforce(instance=instance, session_id=session_id)
-
-
-# configuring openAI access
-openai.api_key = OPENAI_API_KEY
-# openai.api_key = os.getenv('OPENAI_API_KEY')
-client = openai.OpenAI()  # creating an OpenAI client instance
-
-
-def ask_openai(openai_client, system_prompt, user_prompt):
-    """calls openai"""
+import time
+import queue
+import threading
+import functools
+import concurrent.futures
+import config
+import clientManager
+import completionCache
+import emailIndex
+from campaignCache import campaign_cache
+import metrics
+import pendingCards
+import promptTemplates
+import rateLimit
+
+
+# section generation settings (override in config.py)
+SECTION_WORKERS = getattr(config, 'SECTION_WORKERS', 3)  # max concurrent OpenAI section calls per card
+SECTION_TIMEOUT = getattr(config, 'SECTION_TIMEOUT', 30)  # seconds allowed per section once it starts running
+# section threads shared by all requests; OpenAI load across requests is governed by clientManager.openai_limiter,
+# which admits at most OPENAI_MAX_QUEUE waiting calls, so more threads than that would only be rejected
+SECTION_POOL_SIZE = getattr(config, 'SECTION_POOL_SIZE', clientManager.OPENAI_MAX_QUEUE)
+# SOQL threads shared by all requests; sfdc_limiter already caps concurrent SFDC calls
+SFDC_WORKERS = getattr(config, 'SFDC_WORKERS', clientManager.SFDC_MAX_CONCURRENT)
+OPENAI_MODEL = getattr(config, 'OPENAI_MODEL', 'gpt-3.5-turbo')
+GENERATION_MODE = getattr(config, 'GENERATION_MODE', 'sections')  # "sections" or "combined" (one JSON completion)
+GENERATION_MODES = ("sections", "combined")
+# seconds before a slow completion is re-sent (None: off)
+OPENAI_HEDGE_AFTER = getattr(config, 'OPENAI_HEDGE_AFTER', None)
+SECTION_ERROR_PREFIX = "Unexpected error:"  # text shown for a section whose completion failed
+
+
+# shared worker pool for independent SOQL queries
+sfdc_pool = concurrent.futures.ThreadPoolExecutor(max_workers=SFDC_WORKERS, thread_name_prefix='sfdc')
+
+# shared worker pool for section generation (each card runs at most SECTION_WORKERS sections at a time)
+section_pool = concurrent.futures.ThreadPoolExecutor(max_workers=SECTION_POOL_SIZE, thread_name_prefix='section')
+
+# OpenAI calls (and their hedged duplicates) wait here so a slow call can be raced
+openai_pool = concurrent.futures.ThreadPoolExecutor(max_workers=2 * SECTION_POOL_SIZE, thread_name_prefix='openai')
+
+# section generation for cards with a latency budget (keeps running after a partial card is returned)
+card_pool = concurrent.futures.ThreadPoolExecutor(max_workers=SECTION_POOL_SIZE, thread_name_prefix='card')
+
+
+# battle card sections; the hook builds on the other three
+SECTIONS = ["Product Interest", "Where and Why", "Historical Relationship", "Sales Enablement Hook"]
+INDEPENDENT_SECTIONS = SECTIONS[:3]
+HOOK_SECTION = SECTIONS[3]
+COMBINED_SYSTEM_PROMPT = promptTemplates.combined_system_prompt(SECTIONS, HOOK_SECTION)
+
+# define open statuses used for duplicate detection
+OPEN_LEAD_STATUSES = ['.5. Re-New', '1. New', '1.5. Call out', '2. Contacted']
+OPEN_OPPORTUNITY_STAGES = ['1. Qualify', '2. Problem', '3. Solution', '4. Proof', '5. Agreement', '6. Order']
+
+# lead and campaign fields used by the battle card
+LEAD_FIELDS = [
+    "Name",
+    "Title",
+    "Company",
+    "Email",
+    "Phone",
+    "SDR_Agents__c",
+    "NumberOfEmployees__c",
+    "SegmentName__r.Name",
+    "SM_Employees__c",
+    "Status",
+    "LeadSource",
+    "Description",
+    "Lead_Entry_Source__c",
+    "Most_Recent_Campaign_Associated_Date__c",
+    "Most_Recent_Campaign_Description__c",
+    "Most_Recent_Campaign__c",  # Most_Recent_Campaign__r is resolved from the campaign cache
+    "Notes__c"
+]
+CAMPAIGN_HISTORY_FIELDS = "CampaignId, CreatedDate"  # Campaign is resolved from the campaign cache
+
+# local email index for duplicate detection (lookups fall back to SOQL until it is bootstrapped)
+email_index = emailIndex.EmailIndex(OPEN_LEAD_STATUSES, OPEN_OPPORTUNITY_STAGES)
+if emailIndex.EMAIL_INDEX_ENABLED:
+    email_index.start()
+
+
+class SectionError(str):
+    """text of a section (or answer) whose completion failed; still a str so prompts and joins that
+    use it keep working, but recognised by type through is_failed_section rather than by its wording"""
+
+    def __new__(cls, message):
+        return super().__new__(cls, f"{SECTION_ERROR_PREFIX} {message}")
+
+
+def is_failed_section(text):
+    """whether a section, answer or streamed token is a failed completion"""
+    return isinstance(text, SectionError)
+
+
+def build_messages(system_prompt, user_prompt, history=None):
+    """chat messages for a section request (history: earlier conversation turns)"""
+    return [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        *(history or []),
+        {
+            "role": "user",
+            "content": f"Here is the SFDC lead data: {user_prompt}"
+        }
+    ]
+
+
+def hedged_create(openai_client, section, **options):
+    """chat completion that sends a duplicate request once the first has taken OPENAI_HEDGE_AFTER
+    seconds, returning whichever succeeds first; the slower attempt is not cancelled, so every hedge
+    is paid for twice"""
+    if not OPENAI_HEDGE_AFTER:  # hedging disabled
+        return clientManager.openai_create(openai_client, **options)
+    attempts = [openai_pool.submit(metrics.propagate(clientManager.openai_create), openai_client, **options)]
+    done, _ = concurrent.futures.wait(attempts, timeout=OPENAI_HEDGE_AFTER)
+    # calls queued at the limiter mean the quota is the bottleneck, and a duplicate would only take more of it
+    if not done and not clientManager.openai_limiter.queued:
+        metrics.openai_hedges.inc(section=section)
+        metrics.record_count('openai-calls')
+        attempts.append(openai_pool.submit(metrics.propagate(clientManager.openai_create), openai_client, **options))
+    errors = []
+    for attempt in concurrent.futures.as_completed(attempts):
+        try:
+            return attempt.result()
+        except Exception as attempt_error:  # the other attempt may still succeed
+            errors.append(attempt_error)
+    raise errors[0]
+
+
+def ask_openai(openai_client, system_prompt, user_prompt, response_format=None, section=None, history=None):
+    """calls openai (response_format={"type": "json_object"} requests a JSON response, history adds
+    earlier conversation turns); identical requests are answered from the completion cache,
+    counted under `section`"""
+    cache_key = completionCache.completion_key(OPENAI_MODEL, system_prompt, user_prompt, response_format, history)
+    cached = completionCache.get_completion(cache_key, section)
+    if cached is not None:
+        return cached
+    section = section or "Other"
     try:
-        completion = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            temperature=0,
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": f"Here is the SFDC lead data: {user_prompt}"
-                }
-            ]
-        )
-        return completion.choices[0].message.content
+        options = {"response_format": response_format} if response_format else {}
+        messages = build_messages(system_prompt, user_prompt, history)
+        prompt_tokens = promptTemplates.count_message_tokens(messages)
+        metrics.prompt_tokens.observe(prompt_tokens, section=section)
+        metrics.openai_requests.inc(section=section)
+        metrics.record_count('openai-calls')
+        with metrics.timer(metrics.openai_seconds, section=section):
+            completion = hedged_create(
+                openai_client,
+                section,
+                prompt_tokens=prompt_tokens,
+                model=OPENAI_MODEL,
+                temperature=0,
+                messages=messages,
+                **options
+            )
+        metrics.record_usage(section, completion.usage)
+        content = completion.choices[0].message.content
+        completionCache.store_completion(cache_key, content)
+        return content
+    except rateLimit.Throttled:  # over quota: reject the request rather than show the error as a section
+        metrics.openai_errors.inc(section=section)
+        raise
     # debugging
     except Exception as openai_error:
-        return f"Unexpected error: {openai_error}"
+        metrics.openai_errors.inc(section=section)
+        return SectionError(openai_error)
+
+
+def ask_openai_stream(openai_client, system_prompt, user_prompt, section=None):
+    """calls openai with streaming, yielding content tokens as they arrive
+    (a cached completion is yielded as a single token)"""
+    cache_key = completionCache.completion_key(OPENAI_MODEL, system_prompt, user_prompt)
+    cached = completionCache.get_completion(cache_key, section)
+    if cached is not None:
+        yield cached
+        return
+    section = section or "Other"
+    try:
+        messages = build_messages(system_prompt, user_prompt)
+        prompt_tokens = promptTemplates.count_message_tokens(messages)
+        metrics.prompt_tokens.observe(prompt_tokens, section=section)
+        metrics.openai_requests.inc(section=section)
+        metrics.record_count('openai-calls')
+        with metrics.timer(metrics.openai_seconds, section=section):
+            stream = clientManager.openai_create(
+                openai_client,
+                prompt_tokens=prompt_tokens,
+                model=OPENAI_MODEL,
+                temperature=0,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}  # usage arrives in the final chunk
+            )
+            tokens = []
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    metrics.record_usage(section, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    tokens.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        completionCache.store_completion(cache_key, "".join(tokens))  # only complete streams are cached
+    except rateLimit.Throttled:
+        metrics.openai_errors.inc(section=section)
+        raise
+    # debugging
+    except Exception as openai_error:
+        metrics.openai_errors.inc(section=section)
+        yield SectionError(openai_error)
 
 
+@metrics.timed_stage('query_duplicates')
 def query_duplicates(leadID, email):
     """queries all duplicate leads and opportunities with open status"""
-
-    # define open statuses
-    lead_statuses = ['.5. Re-New', '1. New', '1.5. Call out', '2. Contacted']
-    opportunity_stages = ['1. Qualify', '2. Problem', '3. Solution', '4. Proof', '5. Agreement', '6. Order']
+    duplicates = email_index.lookup(leadID, email)
+    if duplicates is not None:  # answered by the local email index
+        return duplicates
 
     # query duplicate leads
     queryLead = f"""
@@ -69,10 +226,10 @@ def query_duplicates(leadID, email):
         FROM Lead
         WHERE Email = '{email}'
         AND Id != '{leadID}'
-        AND Status IN ({', '.join([f"'{status}'" for status in lead_statuses])})
+        AND Status IN ({', '.join([f"'{status}'" for status in OPEN_LEAD_STATUSES])})
     """
-    lead_result = sf.query(queryLead)
-    lead_duplicates = [record['Id'] for record in lead_result['records']]
+    # runs alongside the opportunity query
+    lead_future = sfdc_pool.submit(metrics.propagate(clientManager.sf_query), queryLead)
 
     # query duplicate opportunities
     queryOpportunity = f"""
@@ -83,9 +240,10 @@ def query_duplicates(leadID, email):
             FROM OpportunityContactRole
             WHERE Contact.Email = '{email}'
         )
-        AND StageName IN ({', '.join([f"'{stage}'" for stage in opportunity_stages])})
+        AND StageName IN ({', '.join([f"'{stage}'" for stage in OPEN_OPPORTUNITY_STAGES])})
     """
-    opportunity_result = sf.query(queryOpportunity)
+    opportunity_result = clientManager.sf_query(queryOpportunity)
+    lead_duplicates = [record['Id'] for record in lead_future.result()['records']]
     if not opportunity_result['records']:
         opportunity_duplicates = []
     else:
@@ -97,273 +255,68 @@ def query_duplicates(leadID, email):
     }
 
 
+@metrics.timed_stage('query_product_list')
 def query_product_list():
-    """queries a list of all the RC products in SFDC"""
-    querySOQL = "SELECT Intended_Product__c FROM Campaign GROUP BY Intended_Product__c"
-    result = sf.query(querySOQL)  # query products list (will not return repeated product names)
-    if result['records']:
-        product_list = [record['Intended_Product__c'] for record in result['records'] if record['Intended_Product__c']]
-        return ', '.join(product_list) if product_list else "no products found"
-    else:
-        return "no products found"
+    """list of all the RC products in SFDC (from the campaign cache)"""
+    product_list = campaign_cache.product_list()
+    return ', '.join(product_list) if product_list else "no products found"
 
 
+@metrics.timed_stage('query_campaign_history')
 def query_campaign_history(leadID):
     """queries the 5 most recent campaigns lead engaged with"""
     if leadID:  # check if ID has been received
         # set up
-        fields = "Campaign.Intended_Product__c, Campaign.CreatedDate, Campaign.Name"
+        fields = CAMPAIGN_HISTORY_FIELDS
         obj = "CampaignMember"
         condition = f"LeadId = '{leadID}'"
         querySOQL = f"SELECT {fields} FROM {obj} WHERE {condition} ORDER BY CreatedDate DESC LIMIT 5"
-        result = sf.query(querySOQL)  # query products list (will not return repeated product names)
+        result = clientManager.sf_query(querySOQL)  # query products list (will not return repeated product names)
         if result['records']:
-            return result['records']  # return campaign history
+            return campaign_cache.attach_history(result['records'])  # return campaign history
         else:
             return {"error": "no campaign history found"}
     else:
         return {"error": "no campaign history found"}
 
 
+@metrics.timed_stage('query_lead_data')
 def query_lead_data(leadID):
     """queries Salesforce lead data"""
     if leadID:  # check if ID has been received
         # set up
-        fields_list = [
-            "Name",
-            "Title",
-            "Company",
-            "Email",
-            "Phone",
-            "SDR_Agents__c",
-            "NumberOfEmployees__c",
-            "SegmentName__r.Name",
-            "SM_Employees__c",
-            "Status",
-            "LeadSource",
-            "Description",
-            "Lead_Entry_Source__c",
-            "Most_Recent_Campaign_Associated_Date__c",
-            "Most_Recent_Campaign_Description__c",
-            "Most_Recent_Campaign__c",
-            "Most_Recent_Campaign__r.Name",
-            "Most_Recent_Campaign__r.Intended_Product__c",
-            "Most_Recent_Campaign__r.Description",
-            "Notes__c"
-        ]
         # Join fields into a single string
-        fields = ", ".join(fields_list)
+        fields = ", ".join(LEAD_FIELDS)
         obj = "Lead"
         condition = f"Id = '{leadID}'"
         querySOQL = f"SELECT {fields} FROM {obj} WHERE {condition}"
-        result = sf.query(querySOQL)  # query data
+        result = clientManager.sf_query(querySOQL)  # query data
         if result['records']:
-            return result['records'][0]  # return lead data
+            return campaign_cache.attach_leads(result['records'])[0]  # return lead data
         else:
             return {"error": "no records found"}
     else:
         return {"error": "no records found"}
 
 
-def format_user_prompt(lead_data=None, campaign_history=None):
-    """Formats lead data or campaign history into a compact string for the user prompt."""
-    if lead_data:  # formatting string for lead_data json
-        return (
-            f"Title: {lead_data.get('Title', 'N/A')}, "
-            f"Company: {lead_data.get('Company', 'N/A')}, "
-            f"Number of Employees: {lead_data.get('NumberOfEmployees__c', 'N/A')}, "
-            f"Status: {lead_data.get('Status', 'N/A')}, "
-            f"Lead Source: {lead_data.get('LeadSource', 'N/A')}, "
-            f"Description: {lead_data.get('Description', 'N/A')}, "
-            f"Lead Entry Source: {lead_data.get('Lead_Entry_Source__c', 'N/A')}, "
-            f"Recent Campaign Date: {lead_data.get('Most_Recent_Campaign_Associated_Date__c', 'N/A')}, "
-            f"Recent Campaign Description: {lead_data.get('Most_Recent_Campaign_Description__c', 'N/A')}, "
-            f"Recent Campaign: {lead_data.get('Most_Recent_Campaign__c', 'N/A')}, "
-            f"Recent Campaign Name: "
-            f"{lead_data.get('Most_Recent_Campaign__r', {}).get('Name', 'N/A')}, "
-            "Recent Campaign Product: "
-            f"{lead_data.get('Most_Recent_Campaign__r', {}).get('Intended_Product__c', 'N/A')}, "
-            "Recent Campaign Detailed Description: "
-            f"{lead_data.get('Most_Recent_Campaign__r', {}).get('Description', 'N/A')}, "
-            f"Notes: {lead_data.get('Notes__c', 'N/A')}"
-        )
-    elif campaign_history:  # formatting string for campaign_history json
-        history_entries = []
-        for entry in campaign_history:
-            campaign = entry.get('Campaign', {})
-            history_entries.append(
-                f"Campaign Name: {campaign.get('Name', 'N/A')}, "
-                f"Product: {campaign.get('Intended_Product__c', 'N/A')}, "
-                f"Date: {campaign.get('CreatedDate', 'N/A')}"
-            )
-        return " | ".join(history_entries)
-
-    return "No data available"
-
-
-def summarize_section(section_title, lead_data, products, campaign_history, previous_responses, user_input=None):
+def summarize_section(section_title, lead_data, products, campaign_history, previous_responses, user_input=None,
+                      stream=False, history=None):
     """generates an AI driven summary for a given section:
     1. product interest (use AI to infer)
     2. where and why they are a lead (use data)
     3. history of interactions (use data)
-    4. sales enablement hook (creatively curated for lead)"""
-
-    # background knowledge/ context for pre-processing
-    documentation = (
-        "You are an AI assistant that helps the RingCentral sales reps understand and "
-        "engage with their leads effectively. Using the provided lead data, you will analyze and "
-        "generate insights. Your goal is to help RingCentral sales reps sell and convert leads into opportunities. "
-        "Use the following field value documentation "
-        "to ensure that your responses are insightful, relevant,and tailored to the sales funnel stages. "
-        "- Title: Lead's job position for its company "
-        "- Company: Business or organization the lead is representing. The business we want to sell our product to "
-        "- Status: "
-        "   - X. Suspect: the initial stage where leads are part of the total addressable market. "
-        "   - X. Open: Early interest is shown, but the lead has not been qualified. "
-        "   - 1. New: Leads are ready for initial sales contact through email or phone. "
-        "   - 1.5. Call out: Leads are actively engaged by the sales team. "
-        "   - 2. Contacted: Leads have been contacted and are being nurtured. "
-        "   - 0. Downgraded: Leads that are not currently viable but may be revisited. "
-        "   - .5. Re-New: Downgraded leads that have been re-engaged. "
-        "- Lead Source: how a lead enters the RingCentral system."
-        "- Description: additional description describing the lead."
-        "- Lead Entry Source: specific source of entry where lead entered the RingCentral system. "
-        "- Recent Campaign Product: product being advertised for campaign. "
-        "- Recent Campaign Date: date lead entered campaign. "
-        "- Recent_Campaign Description: brief description of campaign. "
-        "- Recent Campaign Name: campaign last advertised to lead. "
-        "- Campaign History: 5 most recent campaigns along with the products advertised in those campaigns. "
-        "- Most Recent Campaign detailed Description: full description of most recent campaign. "
-        "- Notes: additional information on lead. "
-        "Generate concise bullet points summarizing key details. "
-        "Each point should be one sentence or less, focusing only on essential information for "
-        "quick reference by a sales rep. "
-        "Make sure that the information is direct/ to the point, and relevant to what a sales rep "
-        "may want to know when talking/ engaging with a lead. The information/ insights you provide "
-        "should be quick and easy to read (does not need to be full complete sentences-- sales reps"
-        "should be able to glance at information and understand what to address with lead immediately). "
-        "Sales reps need to be able to look at the generated insights/ inferences "
-        "and make quick decisions for how they will engage/ sell the RingCentral business. "
-    )
+    4. sales enablement hook (creatively curated for lead)
+    with stream=True a generator of response tokens is returned instead;
+    history carries earlier "Ask more" conversation turns"""
 
-    # define RC products and their plans/ pricing
-    RC_products = {
-        "Here is a list of all the products offered by RingCentral along with the possible plans "
-        "and pricing that comes with each product. For each : "
-        "- Phone Systems: "
-        "   - Product: RingEX-- includes a core plan, advanced plan (most popular), and ultra plan (best value) "
-        "      - features included: "
-        "         - business phone system: AI cloud calling (easy to deploy and to use across all devices) "
-        "         - personal AI assistant: real time AI note taking during calls "
-        "             - personalizes insights"
-        "             - crafts messages "
-        "         - enhanced business SMS: business texting optimized for deliver-ability "
-        "         - messaging: team collaboration, chat, and file sharing "
-        "         - video meetings: AI meetings with whiteboard and recording "
-        "         - cloud faxing: easy, secure digital faxing from any device "
-        "   - RingSense AI for RingEX-- need to join wait-list "
-        "- Contact Center: "
-        "   - Product: RingCX powered by RingSense AI "
-        "      - features included: "
-        "         - omnichannel: customer engagement across voice and 20+ digital channel with built in AI "
-        "         - workforce engagement management: AI quality/ workforce management, conversation analytics"
-        "         - outbound: dynamic outbound contact center with built-in campaign management "
-        "   - Product: RingCentral Contact Center Enterprise "
-        "- Video: "
-        "   - Product: Video Pro "
-        "   - Product: Video Pro+ "
-        "   - Product: Webinar-- large meeting and webinars made effortless with AI "
-        "   - Product: Rooms-- video enabled conference rooms and meeting spaces with one click join "
-        "- Events: "
-        "   - Product: Events-- all in one, AI powered event management for virtual, hybrid, and in person events  "
-        "- Sales Intelligence: "
-        "   - RingSense for Sales-- AI sales and conversation intelligence; boosts team collaboration and strategy  "
-        "Do research on each RingCentral product and identify their "
-        "individual value propositions and functions. Additionally, do research on the different RingCentral "
-        "Plans and Pricing offered for these products. "
-    }
-
-    # define system prompts based on section for requests
-    section_prompts = {
-        "Product Interest": (
-            f"{RC_products} "
-            # f"Here is a list of all the products that RingCentral has to offer: {products}. "
-            "Do external research on the lead's company background, including recent news, "
-            "industry, and business model, and suggest which RingCentral product(s) the lead might "
-            "be most interested in. "
-            "Using all the collected information and the lead data-- "
-            "leadSource, Lead_Entry_Source, most recent campaign information, and campaign product-- "
-            "come up with 1-2 RingCentral products (choose from the ones listed tagged 'Product: <Product name>') "
-            "the lead may be interested in. "
-            "In bullet points, provide the following information for each RingCentral product: "
-            "- **Product**: <Product name> "
-            "- **Recommended Pricing Plan**: <ideal pricing plan (only provide this bullet if applicable)> "
-            "- **Why**: <one sentence reasoning a sales rep could use to advertise "
-            "and cater the product towards  the lead. Make sure to connect the lead company's needs with "
-            "the features of the suggested product(s). "
-            "Be sure to use the lead's industry context, company size, company location, and "
-            "past product interest data from similar companies where it is applicable/ available> "
-            "NOTE: Ensure that each bullet is not overwhelmed with information. Remember to get "
-            "straight to the point (do not use full sentences, insights provided should just be notes for a sales "
-            "rep to use when engaging with the lead). "
-            "NOTE: Your response should only include the information about the RingCentral product "
-            "the lead may be interested in. Do not provide any additional information in your response. "
-        ),
-        "Where and Why": (
-            "Assess the lead's journey by looking at their Status and most recent campaign information. "
-            "Use the Description and Notes__c if relevant. "
-            "Summarize the following information about the lead in three bullets: "
-            "- **Where**: <where the start of the lead's journey with RingCentral began> "
-            "- **Why**: <why the lead entered the RingCentral system>  "
-            "- **Current**: <their current relationship with RingCentral>"
-        ),
-        "Historical Relationship": (
-            "Provide a bulleted rundown (no more than 2-4 bullets) of the lead's historical relationship with "
-            "RingCentral. Identify a pattern, a consistent interest in a certain part of the RingCentral business/ "
-            "product or anything that stands out with the campaign history provided "
-            "(use specific campaign names and products). "
-            "Provided will be 5 (if applicable) most recent campaigns the lead engaged with. "
-        ),
-        "Sales Enablement Hook": (
-            "Develop a compelling sales enablement hook. This hook should be creative, leverage recent industry "
-            "trends or company news, and directly address potential pain points or needs identified by the lead. "
-            "The hook should be in the form of a bulleted list (no more than 3 bullets) that highlights "
-            "talking points the sales rep could use. Remember to get "
-            "straight to the point (do not use full sentences, insights provided should just be notes for a sales "
-            "rep to use when engaging with the lead). "
-            "Make sure that talking points are applicable to the most recent news on the lead's company "
-            "or pain points. Be specific with the recent updates/ pain points about the company and relate them "
-            "to how RingCentral can provide a solution for them. "
-            "NOTE: your response should only include the sales enablement hook. "
-            "Do not provide any additional information. "
-        ),
-        "Ask more": (
-            "Respond to the sales rep's inquiries about the lead. "
-            "If questions about the company arise, conduct external research. "
-            "For questions regarding specific detail about the lead, rely on the provided lead data "
-            "and campaign history to offer insightful responses. However, do not fabricate any information-- "
-            "stick strictly to the data you have. It's acceptable to inform the user if you do not have access to "
-            "certain requested information. "
-            "It's also important to disclose that the information you're working with is limited. "
-            "The details you can share with the user include: "
-            "lead name, company name, lead's title at the company, contact information, "
-            "SDR agents, company size, lead status, lead source, lead entry source, "
-            "information about the most recent campaign the lead engaged with, and the five most recently "
-            "attended campaigns. "
-            "Any other information is beyond your current knowledge. "
-            f"Here is the lead data and campaign history: "
-            f"{format_user_prompt(lead_data=lead_data)} {format_user_prompt(campaign_history=campaign_history)}"
-        )
-    }
-
-    # select system prompt for request
-    system_prompt = documentation + section_prompts.get(section_title, "Invalid section title")
+    # select system prompt for request (static prefixes are built once in promptTemplates)
+    system_prompt = promptTemplates.system_prompt(section_title, lead_data, campaign_history)
 
     # format data as string for user prompt
     if section_title == "Product Interest" or section_title == "Where and Why":
-        user_prompt = format_user_prompt(lead_data=lead_data)
+        user_prompt = promptTemplates.format_user_prompt(lead_data=lead_data)
     elif section_title == "Historical Relationship":
-        user_prompt = format_user_prompt(campaign_history=campaign_history)
+        user_prompt = promptTemplates.format_user_prompt(campaign_history=campaign_history)
     elif section_title == "Sales Enablement Hook":
         user_prompt = "\n".join(previous_responses.values())
     elif section_title == "Ask more":
@@ -371,43 +324,341 @@ def summarize_section(section_title, lead_data, products, campaign_history, prev
     else:
         user_prompt = "No relevant data available."
 
-    return ask_openai(client, system_prompt, user_prompt)
+    if stream:
+        return ask_openai_stream(clientManager.get_openai_client(), system_prompt, user_prompt, section=section_title)
+    with metrics.timer(metrics.section_seconds, f"section {section_title}", section=section_title):
+        return ask_openai(clientManager.get_openai_client(), system_prompt, user_prompt, section=section_title,
+                          history=history)
+
+
+class SectionCall:
+    """a section generated on a section pool; its timeout starts when a worker (and one of the card's
+    SECTION_WORKERS slots) picks it up, so time spent queued does not count against it"""
+
+    def __init__(self, pool, slots, section_title, *args):
+        self.slots = slots
+        self.section_title = section_title
+        self.started = threading.Event()
+        self.start_time = None
+        self.future = pool.submit(metrics.propagate(self.run), *args)
+
+    def run(self, *args):
+        with self.slots:
+            self.start_time = time.monotonic()
+            self.started.set()
+            return summarize_section(self.section_title, *args)
+
+    def result(self):
+        """waits for the section until SECTION_TIMEOUT after it started (a section still queued at
+        the request deadline is dropped)"""
+        queued_until = rateLimit.request_deadline.get()
+        try:
+            if not self.started.wait(None if queued_until is None else max(0, queued_until - time.monotonic())):
+                self.future.cancel()
+                return SectionError(f"{self.section_title} was still queued at the request deadline")
+            return self.future.result(timeout=max(0, self.start_time + SECTION_TIMEOUT - time.monotonic()))
+        except concurrent.futures.TimeoutError:
+            return SectionError(f"{self.section_title} timed out after {SECTION_TIMEOUT} seconds")
+        except rateLimit.Throttled:
+            raise
+        except Exception as section_error:
+            return SectionError(section_error)
+
+
+def fetch_lead_context(leadID, include_products=False):
+    """fetches the SFDC data for a battle card with overlapping round trips:
+    campaign history runs alongside the lead query and the duplicate lookups
+    start once the lead's email is known and it has campaign history (a lead
+    without one gets no card, so its duplicates are not queried)"""
+    campaign_future = sfdc_pool.submit(metrics.propagate(query_campaign_history), leadID)
+    # product list is only needed if its Product Interest prompt line is enabled
+    products_future = sfdc_pool.submit(metrics.propagate(query_product_list)) if include_products else None
+
+    lead_data = query_lead_data(leadID)
+    campaign_history = campaign_future.result()
+    duplicates = None
+    if "error" not in lead_data and "error" not in campaign_history:  # duplicates need the lead's email
+        duplicates = query_duplicates(leadID, lead_data.get("Email", ""))
 
+    return {
+        "lead_data": lead_data,
+        "campaign_history": campaign_history,
+        "duplicates": duplicates,
+        "products": products_future.result() if products_future else None
+    }
 
-def query_and_summarize_lead(leadID):
-    """completes summary response for lead data"""
-    products = query_product_list()  # get list of product for product interest section
-    campaign_history = query_campaign_history(leadID)  # get lead campaign history
 
-    if "error" in campaign_history:  # query failed
-        return campaign_history
+def lead_general_info(lead_data):
+    """general information about lead shown at the top of the card"""
+    general_info = {}
+    for field in ["Name", "Company", "Title", "Email", "Phone", "Status", "SegmentName__r.Name", "SM_Employees__c"]:
+        if field == "SegmentName__r.Name":
+            general_info["Segment Name"] = lead_data.get('SegmentName__r', {}).get('Name', 'N/A')
+        elif field == "SM_Employees__c":
+            general_info["SM Employees"] = str(lead_data.get(field, ''))
+        else:
+            general_info[field] = lead_data.get(field, '')
+    return general_info
 
-    lead_data = query_lead_data(leadID)  # get lead data for user prompt
-    if "error" in lead_data:  # query failed
-        return lead_data
 
-    # define sections for summary and storage container for AI responses
-    sections = ["Product Interest", "Where and Why", "Historical Relationship", "Sales Enablement Hook"]
-    summary_dict = {}
+def record_progress(progress, section, future):
+    """done callback publishing a finished section to `progress`"""
+    if not future.cancelled() and future.exception() is None:
+        progress[section] = future.result()
+
+
+def summarize_sections(lead_data, products, campaign_history, completed=None, progress=None, pool=None):
+    """generates the battle card sections concurrently on `pool` (default section_pool); sections
+    already in `completed` are reused and every section is added to `progress` (if given) as soon
+    as it finishes"""
+    pool = pool or section_pool
+    sections = dict(completed or {})
     previous_responses = {"Company": f"{lead_data.get('Company', '')}"}
+    if progress is not None:
+        progress.update(sections)
+
+    # independent sections are generated concurrently
+    slots = threading.BoundedSemaphore(SECTION_WORKERS)
+    calls = {
+        section: SectionCall(pool, slots, section, lead_data, products, campaign_history, previous_responses)
+        for section in INDEPENDENT_SECTIONS if section not in sections
+    }
+    if progress is not None:
+        for section, call in calls.items():
+            call.future.add_done_callback(functools.partial(record_progress, progress, section))
+    for section in INDEPENDENT_SECTIONS:  # collect in order so the hook sees a stable prompt
+        if section in calls:
+            sections[section] = calls[section].result()
+        previous_responses[section] = sections[section]  # store previous responses for sales enablement hook
+
+    # sales enablement hook builds on the previous responses
+    if HOOK_SECTION not in sections:
+        call = SectionCall(pool, slots, HOOK_SECTION, lead_data, products, campaign_history, previous_responses)
+        sections[HOOK_SECTION] = call.result()
+        if progress is not None:
+            progress[HOOK_SECTION] = sections[HOOK_SECTION]
+
+    return {section: sections[section] for section in SECTIONS}
+
+
+def parse_sections_json(response):
+    """keeps the sections of a combined JSON response that match the schema
+    (every section is a non-empty string; anything else is treated as missing)"""
+    try:
+        parsed = json.loads(response)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {
+        section: parsed[section].strip()
+        for section in SECTIONS
+        if isinstance(parsed.get(section), str) and parsed[section].strip()
+    }
+
+
+def summarize_all_sections(lead_data, products, campaign_history, progress=None, pool=None):
+    """generates every section in a single JSON completion; sections missing from or invalid in
+    the response fall back to their own summarize_section call"""
+    user_prompt = (
+        f"{promptTemplates.format_user_prompt(lead_data=lead_data)} "
+        f"Campaign History: {promptTemplates.format_user_prompt(campaign_history=campaign_history)}"
+    )
+    response = ask_openai(clientManager.get_openai_client(), COMBINED_SYSTEM_PROMPT, user_prompt,
+                          response_format={"type": "json_object"}, section="Combined")
+    return summarize_sections(lead_data, products, campaign_history, completed=parse_sections_json(response),
+                              progress=progress, pool=pool)
+
 
-    for section in sections:  # traverse each section and create summary for each
-        summary = summarize_section(section, lead_data, products, campaign_history, previous_responses)
-        summary_dict[section] = summary  # store in summary dictionary
-        previous_responses[section] = summary  # store previous responses for sales enablement hook
+def generate_sections(lead_data, products, campaign_history, mode=None, progress=None, pool=None):
+    """generates the AI sections (mode: "sections" for one completion per section, "combined" for a
+    single JSON completion; pool: section pool, default section_pool)"""
+    if (mode or GENERATION_MODE) == "combined":
+        return summarize_all_sections(lead_data, products, campaign_history, progress=progress, pool=pool)
+    return summarize_sections(lead_data, products, campaign_history, progress=progress, pool=pool)
+
+
+def assemble_card(sections, lead_data, duplicates):
+    """battle card from the generated sections and fetched SFDC data; sections whose completion
+    failed are left empty and reported under "errors" instead of showing the error as section text"""
+    summary_dict = {}
+    errors = {}
+    for section, text in sections.items():
+        if is_failed_section(text):
+            errors[section] = text
+            text = None
+        summary_dict[section] = text
+    if errors:
+        summary_dict["errors"] = errors
 
     # include general information about lead
-    for field in ["Name", "Company", "Title", "Email", "Phone", "Status", "SegmentName__r.Name", "SM_Employees__c"]:
-        if field == "SegmentName__r.Name":
-            summary_dict["Segment Name"] = lead_data.get('SegmentName__r', {}).get('Name', 'N/A')
-        elif field == "SM_Employees__c":
-            summary_dict["SM Employees"] = str(lead_data.get(field, ''))
-        else:
-            summary_dict[field] = lead_data.get(field, '')
+    summary_dict.update(lead_general_info(lead_data))
 
     # add duplicate lead IDs to response
-    duplicates = query_duplicates(leadID, lead_data.get("Email", ""))
     summary_dict["Duplicate Leads"] = duplicates.get('Duplicate Leads')
     summary_dict["Duplicate Opportunities"] = duplicates.get('Duplicate Opportunities')
 
     return summary_dict
+
+
+def build_summary(lead_data, campaign_history, duplicates, products=None, mode=None, pool=None):
+    """generates the AI sections and assembles the battle card from fetched SFDC data"""
+    return assemble_card(generate_sections(lead_data, products, campaign_history, mode=mode, pool=pool), lead_data,
+                         duplicates)
+
+
+def finish_pending_card(requestID, lead_data, duplicates, on_complete, future):
+    """done callback of a card returned with pending sections: publishes the remaining sections
+    and hands the complete card to on_complete"""
+    if future.exception() is not None:
+        pendingCards.finish(requestID, error=str(future.exception()))
+        return
+    pendingCards.finish(requestID, future.result())
+    if on_complete:
+        on_complete(assemble_card(future.result(), lead_data, duplicates))
+
+
+def query_and_summarize_lead(leadID, mode=None, budget=None, on_complete=None):
+    """completes summary response for lead data; with a latency budget (seconds) the card is
+    returned when the budget runs out, with the sections that are not ready yet listed under
+    "pending" (fetch them later with pendingCards.get(request_id)); on_complete then receives the
+    complete card once the remaining sections finish"""
+    deadline = time.monotonic() + budget if budget else None
+    context = fetch_lead_context(leadID)
+
+    campaign_history = context["campaign_history"]  # get lead campaign history
+    if "error" in campaign_history:  # query failed
+        return campaign_history
+
+    lead_data = context["lead_data"]  # get lead data for user prompt
+    if "error" in lead_data:  # query failed
+        return lead_data
+
+    if deadline is None:
+        return build_summary(lead_data, campaign_history, context["duplicates"], context["products"], mode=mode)
+
+    progress = {}  # sections published as they finish
+    future = card_pool.submit(metrics.propagate(generate_sections), lead_data, context["products"], campaign_history,
+                              mode, progress)
+    try:
+        return assemble_card(future.result(timeout=max(0, deadline - time.monotonic())), lead_data,
+                             context["duplicates"])
+    except concurrent.futures.TimeoutError:
+        pass
+
+    ready = dict(progress)
+    requestID = pendingCards.start(leadID, progress, SECTIONS)
+    future.add_done_callback(functools.partial(finish_pending_card, requestID, lead_data, context["duplicates"],
+                                               on_complete))
+    summary = assemble_card({section: ready.get(section) for section in SECTIONS}, lead_data, context["duplicates"])
+    summary["pending"] = [section for section in SECTIONS if section not in ready]
+    summary["request_id"] = requestID
+    return summary
+
+
+def section_event(section, summary):
+    """stream event for a finished section; a failed completion is sent with null data and the
+    error under "error", matching the "errors" map of assemble_card"""
+    if is_failed_section(summary):
+        return {"event": "section", "section": section, "data": None, "error": summary}
+    return {"event": "section", "section": section, "data": summary}
+
+
+def stream_summary(leadID, stream_tokens=False, mode=None):
+    """yields battle card events as soon as each part is ready: lead general info first,
+    then duplicates, then each section as its completion arrives (optionally token by token)"""
+    campaign_future = sfdc_pool.submit(metrics.propagate(query_campaign_history), leadID)
+    lead_data = query_lead_data(leadID)
+    if "error" in lead_data:  # query failed
+        yield {"event": "error", "data": lead_data}
+        return
+    yield {"event": "general", "data": lead_general_info(lead_data)}
+
+    campaign_history = campaign_future.result()
+    if "error" in campaign_history:  # query failed (no card, so duplicates are not queried)
+        yield {"event": "error", "data": campaign_history}
+        return
+
+    duplicates = query_duplicates(leadID, lead_data.get("Email", ""))
+    yield {"event": "duplicates", "data": duplicates}
+
+    if (mode or GENERATION_MODE) == "combined":  # all sections arrive together from one completion
+        for section, summary in summarize_all_sections(lead_data, None, campaign_history).items():
+            yield section_event(section, summary)
+        yield {"event": "done"}
+        return
+
+    # section threads report tokens and finished sections through this queue
+    events = queue.Queue()
+    previous_responses = {"Company": f"{lead_data.get('Company', '')}"}
+    slots = threading.BoundedSemaphore(SECTION_WORKERS)
+    started = {}  # section -> monotonic time a worker started it
+
+    def run_section(section):
+        with slots:
+            started[section] = time.monotonic()
+            generate_section(section)
+
+    def generate_section(section):
+        try:
+            if stream_tokens:
+                tokens = []
+                for token in summarize_section(section, lead_data, None, campaign_history, previous_responses,
+                                               stream=True):
+                    if is_failed_section(token):  # failed completion: reported by the section event
+                        summary = token
+                        break
+                    tokens.append(token)
+                    events.put({"event": "delta", "section": section, "data": token})
+                else:
+                    summary = "".join(tokens)
+            else:
+                summary = summarize_section(section, lead_data, None, campaign_history, previous_responses)
+        except rateLimit.Throttled as throttled:
+            events.put({"event": "error", "section": section,
+                        "data": {"error": str(throttled), "retry_after": throttled.retry_after}})
+            return
+        events.put(section_event(section, summary))
+
+    def drain(sections):
+        """forwards queued events until every section finished or timed out"""
+        pending = set(sections)
+        completed = {}
+        while pending:
+            # each section's timeout counts from when it started; queued sections get a full SECTION_TIMEOUT
+            deadline = max(started.get(section, time.monotonic()) + SECTION_TIMEOUT for section in pending)
+            try:
+                event = events.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if event["section"] not in sections:  # late output of a section that already timed out
+                continue
+            if event["event"] == "error":  # throttled: end the card instead of streaming error sections
+                throttled.append(event)
+                yield event
+                return
+            if event["event"] == "section" and event["section"] in pending:
+                pending.discard(event["section"])
+                completed[event["section"]] = event.get("error") or event["data"]  # the hook sees errors as text
+            yield event
+        for section in pending:  # report sections that did not finish in time
+            summary = SectionError(f"{section} timed out after {SECTION_TIMEOUT} seconds")
+            completed[section] = summary
+            yield section_event(section, summary)
+        previous_responses.update({section: completed[section] for section in sections})
+
+    # independent sections are generated concurrently
+    throttled = []
+    for section in INDEPENDENT_SECTIONS:
+        section_pool.submit(metrics.propagate(run_section), section)
+    yield from drain(INDEPENDENT_SECTIONS)
+    if throttled:
+        return
+
+    # sales enablement hook builds on the previous responses
+    section_pool.submit(metrics.propagate(run_section), HOOK_SECTION)
+    yield from drain([HOOK_SECTION])
+    if throttled:
+        return
+
+    yield {"event": "done"}
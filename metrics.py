@@ -0,0 +1,222 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    """monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """cumulative bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """current value with optional labels"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+
+# pipeline metrics
+stage_seconds = Histogram('battlecard_stage_seconds', 'Wall time of SFDC query stages.')
+stage_errors = Counter('battlecard_stage_errors_total', 'Exceptions raised by SFDC query stages.')
+section_seconds = Histogram('battlecard_section_seconds', 'Wall time to generate a battle card section.')
+openai_seconds = Histogram('openai_request_seconds', 'Wall time of OpenAI chat completion calls.')
+openai_requests = Counter('openai_requests_total', 'OpenAI chat completion calls (cache hits excluded).')
+openai_errors = Counter('openai_errors_total', 'OpenAI chat completion calls that failed.')
+openai_hedges = Counter('openai_hedged_requests_total', 'Duplicate OpenAI requests sent for slow completions.')
+openai_tokens = Counter('openai_tokens_total', 'Tokens reported in the OpenAI usage field.')
+prompt_tokens = Histogram('openai_prompt_tokens', 'Prompt tokens per OpenAI request, counted before it is sent.',
+                          buckets=TOKEN_BUCKETS)
+sfdc_calls = Counter('sfdc_api_calls_total', 'Salesforce API calls (query, query_all, login).')
+sfdc_seconds = Histogram('sfdc_request_seconds', 'Wall time of Salesforce API calls.')
+http_requests = Counter('http_requests_total', 'HTTP requests handled by the API.')
+http_seconds = Histogram('http_request_seconds', 'Wall time of HTTP requests.')
+prompt_fields_trimmed = Counter('prompt_fields_trimmed_total',
+                                'Free-text lead fields trimmed to the prompt token budget.')
+queue_depth = Gauge('api_queue_depth', 'Calls waiting for admission to an upstream API.')
+throttle_events = Counter('api_throttle_events_total',
+                          'Upstream API calls delayed, rejected, timed out or retried under rate limits.')
+
+METRICS = [stage_seconds, stage_errors, section_seconds, openai_seconds, openai_requests, openai_errors,
+           openai_hedges, openai_tokens, prompt_tokens, sfdc_calls, sfdc_seconds, http_requests, http_seconds,
+           prompt_fields_trimmed, queue_depth, throttle_events]
+
+
+def render():
+    """all metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestTimings:
+    """per-request breakdown of stage durations and API usage"""
+
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add_duration(self, stage, seconds):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def add_count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def server_timing(self):
+        """Server-Timing header value (durations in milliseconds, counts as descriptions)"""
+        with self._lock:
+            entries = [f"{header_name(stage)};dur={seconds * 1000:.1f}" for stage, seconds in self.durations.items()]
+            entries += [f'{header_name(name)};desc="{amount}"' for name, amount in self.counts.items()]
+        return ", ".join(entries)
+
+
+def header_name(stage):
+    return ''.join(ch if ch.isalnum() else '-' for ch in stage.lower())
+
+
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def start_request():
+    """starts collecting a timing breakdown for the current request"""
+    timings = RequestTimings()
+    current_request.set(timings)
+    return timings
+
+
+def record_duration(stage, seconds):
+    timings = current_request.get()
+    if timings is not None:
+        timings.add_duration(stage, seconds)
+
+
+def record_count(name, amount=1):
+    timings = current_request.get()
+    if timings is not None:
+        timings.add_count(name, amount)
+
+
+def propagate(fn):
+    """binds fn to a copy of the caller's context so work submitted to a thread pool
+    still adds to the submitting request's timings"""
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+@contextmanager
+def timer(histogram, breakdown=None, **labels):
+    """observes the block's wall time in `histogram` (and under `breakdown` in the request breakdown)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **labels)
+        if breakdown:
+            record_duration(breakdown, elapsed)
+
+
+def timed_stage(stage):
+    """decorator timing a SFDC query stage and counting its errors"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage_seconds, stage, stage=stage):
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    stage_errors.inc(stage=stage)
+                    raise
+        return wrapper
+    return decorator
+
+
+def record_usage(section, usage):
+    """adds the token counts from an OpenAI usage field"""
+    if usage is None:
+        return
+    openai_tokens.inc(usage.prompt_tokens, section=section, type='prompt')
+    openai_tokens.inc(usage.completion_tokens, section=section, type='completion')
+    record_count('openai-prompt-tokens', usage.prompt_tokens)
+    record_count('openai-completion-tokens', usage.completion_tokens)
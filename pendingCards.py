@@ -0,0 +1,57 @@
+import threading
+import uuid
+import config
+import generateSummary
+from cacheStore import LRUCache
+
+
+# pending card settings (override in config.py)
+PENDING_CARD_TTL = getattr(config, 'PENDING_CARD_TTL', 600)  # seconds a partial card's sections can be fetched
+PENDING_CARD_MAX = getattr(config, 'PENDING_CARD_MAX', 1000)  # max partial cards tracked
+
+# request ID -> sections of a card returned before every section was ready
+results = LRUCache(PENDING_CARD_MAX, ttl=PENDING_CARD_TTL)
+lock = threading.Lock()
+
+
+def start(leadID, sections, titles):
+    """tracks a partial card; `sections` is the live dict its background work fills in"""
+    requestID = uuid.uuid4().hex
+    results.set(requestID, {'lead_id': leadID, 'sections': sections, 'titles': list(titles), 'status': 'pending',
+                            'error': None})
+    return requestID
+
+
+def finish(requestID, sections=None, error=None):
+    """records the finished sections (or the error that stopped the card)"""
+    entry = results.get(requestID)
+    if entry is None:  # expired before the card finished
+        return
+    with lock:
+        entry['sections'].update(sections or {})
+        entry['status'] = 'failed' if error else 'complete'
+        entry['error'] = error
+
+
+def get(requestID):
+    """the sections ready so far, the ones still pending and any that failed (None if unknown or expired)"""
+    entry = results.get(requestID)
+    if entry is None:
+        return None
+    with lock:
+        ready = dict(entry['sections'])
+        status, error = entry['status'], entry['error']
+    # sections whose completion failed are reported as errors, not as section text
+    errors = {title: text for title, text in ready.items() if generateSummary.is_failed_section(text)}
+    sections = {title: text for title, text in ready.items() if title not in errors}
+    result = {
+        'request_id': requestID,
+        'lead_id': entry['lead_id'],
+        'status': status,
+        'sections': sections,
+        'pending': [title for title in entry['titles'] if title not in ready] if status == 'pending' else [],
+        'errors': errors
+    }
+    if error:
+        result['error'] = error
+    return result
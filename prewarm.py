@@ -0,0 +1,222 @@
+import calendar
+import concurrent.futures
+import heapq
+import threading
+import time
+import config
+import clientManager
+import generateSummary
+import metrics
+import summaryCache
+from soqlHelpers import SYNC_OVERLAP, soql_datetime, soql_list
+
+
+# pre-warm settings (override in config.py)
+PREWARM_ENABLED = getattr(config, 'PREWARM_ENABLED', False)  # run the worker inside the API process
+PREWARM_INTERVAL = getattr(config, 'PREWARM_INTERVAL', 120)  # seconds between SFDC polls
+PREWARM_LOOKBACK = getattr(config, 'PREWARM_LOOKBACK', 3600)  # seconds of activity picked up by the first poll
+PREWARM_WORKERS = getattr(config, 'PREWARM_WORKERS', 2)  # cards built concurrently
+PREWARM_MAX_QUEUE = getattr(config, 'PREWARM_MAX_QUEUE', 1000)  # leads waiting to be pre-warmed
+PREWARM_DAILY_SFDC_CALLS = getattr(config, 'PREWARM_DAILY_SFDC_CALLS', 5000)  # SFDC API calls per UTC day
+PREWARM_DAILY_OPENAI_CALLS = getattr(config, 'PREWARM_DAILY_OPENAI_CALLS', 2000)  # OpenAI calls per UTC day
+
+# worst case cost of one card, reserved before it is built (actual usage is charged afterwards);
+# SFDC: freshness probe, lead, campaign history, 2 campaign lookups by ID, an incremental campaign
+# refresh, and 2 duplicate queries twice (prefetched for a cached card that turns out stale, then rebuilt)
+SFDC_CALLS_PER_CARD = 1 + 2 + 2 + 1 + 2 * 2
+OPENAI_CALLS_PER_CARD = 4
+
+# lower runs first
+PRIORITY_NEW_LEAD = 0
+PRIORITY_NEW_CAMPAIGN = 1
+PRIORITY_UPDATED_LEAD = 2
+
+
+class DailyBudget:
+    """SFDC and OpenAI call allowance that resets at UTC midnight"""
+
+    def __init__(self, sfdc_calls, openai_calls):
+        self.limits = {'sfdc': sfdc_calls, 'openai': openai_calls}
+        self.used = {'sfdc': 0, 'openai': 0}
+        self.day = time.gmtime().tm_yday
+        self.lock = threading.Lock()
+
+    def _roll_over(self):
+        today = time.gmtime().tm_yday
+        if today != self.day:
+            self.day = today
+            self.used = {'sfdc': 0, 'openai': 0}
+
+    def reserve(self, sfdc, openai):
+        """takes the calls from today's allowance if there is room"""
+        with self.lock:
+            self._roll_over()
+            if self.used['sfdc'] + sfdc > self.limits['sfdc'] or self.used['openai'] + openai > self.limits['openai']:
+                return False
+            self.used['sfdc'] += sfdc
+            self.used['openai'] += openai
+            return True
+
+    def settle(self, reserved_sfdc, reserved_openai, sfdc, openai):
+        """replaces a reservation with the calls actually made"""
+        with self.lock:
+            self._roll_over()
+            self.used['sfdc'] = max(0, self.used['sfdc'] - reserved_sfdc + sfdc)
+            self.used['openai'] = max(0, self.used['openai'] - reserved_openai + openai)
+
+    def status(self):
+        with self.lock:
+            self._roll_over()
+            return {'used': dict(self.used), 'limits': dict(self.limits)}
+
+
+class PrewarmWorker:
+    """polls SFDC for newly created, reassigned or newly campaigned leads and builds their
+    cards into the summary cache before a rep opens them"""
+
+    def __init__(self):
+        self.watermark = time.time() - PREWARM_LOOKBACK
+        self.queue = []  # heap of (priority, -activity time, lead ID)
+        self.queued = set()
+        self.budget = DailyBudget(PREWARM_DAILY_SFDC_CALLS, PREWARM_DAILY_OPENAI_CALLS)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=PREWARM_WORKERS, thread_name_prefix='prewarm')
+        self.stats = {'polls': 0, 'cards_built': 0, 'errors': 0, 'budget_exhausted': 0}
+        self.last_error = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enqueue(self, leadID, priority, activity):
+        self.push((priority, -activity, leadID))
+
+    def push(self, entry):
+        with self.lock:
+            if entry[2] in self.queued or len(self.queue) >= PREWARM_MAX_QUEUE:
+                return
+            self.queued.add(entry[2])
+            heapq.heappush(self.queue, entry)
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def poll(self):
+        """queues leads with activity since the watermark"""
+        if not self.budget.reserve(2, 0):
+            self.count('budget_exhausted')
+            return
+        poll_start = time.time()
+        since = soql_datetime(self.watermark)
+        statuses = soql_list(generateSummary.OPEN_LEAD_STATUSES)
+
+        # new or reassigned leads (reassignment updates LastModifiedDate)
+        queryLead = f"""
+            SELECT Id, CreatedDate, LastModifiedDate
+            FROM Lead
+            WHERE LastModifiedDate >= {since}
+            AND SDR_Agents__c != null
+            AND Status IN ({statuses})
+        """
+        for record in clientManager.sf_query_all(queryLead)['records']:
+            created = parse_time(record['CreatedDate'])
+            if created >= self.watermark:
+                self.enqueue(record['Id'], PRIORITY_NEW_LEAD, created)
+            else:
+                self.enqueue(record['Id'], PRIORITY_UPDATED_LEAD, parse_time(record['LastModifiedDate']))
+
+        # leads that just joined a campaign
+        queryMember = f"""
+            SELECT LeadId, CreatedDate
+            FROM CampaignMember
+            WHERE CreatedDate >= {since}
+            AND LeadId != null
+            AND Lead.Status IN ({statuses})
+        """
+        for record in clientManager.sf_query_all(queryMember)['records']:
+            self.enqueue(record['LeadId'], PRIORITY_NEW_CAMPAIGN, parse_time(record['CreatedDate']))
+
+        self.watermark = poll_start - SYNC_OVERLAP
+        self.count('polls')
+
+    def pop(self):
+        with self.lock:
+            if not self.queue:
+                return None
+            entry = heapq.heappop(self.queue)
+            self.queued.discard(entry[2])
+            return entry
+
+    def build_card(self, leadID):
+        """builds one card through the summary cache, charging its actual API usage to the budget"""
+        timings = metrics.start_request()  # counts this card's SFDC and OpenAI calls
+        try:
+            summaryCache.get_lead_summary(leadID)
+            self.count('cards_built')
+        except Exception as card_error:
+            self.count('errors')
+            self.last_error = str(card_error)
+        finally:
+            self.budget.settle(SFDC_CALLS_PER_CARD, OPENAI_CALLS_PER_CARD,
+                               timings.counts.get('sfdc-calls', 0), timings.counts.get('openai-calls', 0))
+
+    def drain(self):
+        """builds queued cards in priority order until the queue is empty or the budget runs out"""
+        while True:
+            leads = []
+            while len(leads) < PREWARM_WORKERS:
+                entry = self.pop()
+                if entry is None:
+                    break
+                if not self.budget.reserve(SFDC_CALLS_PER_CARD, OPENAI_CALLS_PER_CARD):
+                    self.count('budget_exhausted')
+                    self.push(entry)  # keeps its place until the budget resets
+                    break
+                leads.append(entry[2])
+            if not leads:
+                return
+            list(self.pool.map(self.build_card, leads))
+
+    def run_once(self):
+        try:
+            self.poll()
+            self.drain()
+            self.last_error = None
+        except Exception as worker_error:
+            self.count('errors')
+            self.last_error = str(worker_error)
+
+    def run(self):
+        while True:
+            self.run_once()
+            time.sleep(PREWARM_INTERVAL)
+
+    def start(self):
+        """runs the worker on a background thread of this process"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='prewarm', daemon=True)
+            self.thread.start()
+
+    def status(self):
+        with self.lock:
+            queued = len(self.queue)
+            stats = dict(self.stats)
+        return {
+            'running': self.thread is not None,
+            'queued': queued,
+            'watermark': soql_datetime(self.watermark),
+            'budget': self.budget.status(),
+            'stats': stats,
+            'last_error': self.last_error
+        }
+
+
+def parse_time(sfdc_datetime):
+    """SFDC datetime string (e.g. 2024-05-01T12:30:00.000+0000) as a unix timestamp"""
+    return calendar.timegm(time.strptime(sfdc_datetime[:19], '%Y-%m-%dT%H:%M:%S'))
+
+
+worker = PrewarmWorker()
+
+
+if __name__ == '__main__':
+    # separate worker process: python3 prewarm.py (set SUMMARY_CACHE_PATH so the API process sees the cards)
+    worker.run()
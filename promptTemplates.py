@@ -0,0 +1,286 @@
+import config
+import metrics
+
+
+# token budgets (override in config.py)
+PROMPT_FIELD_TOKENS = getattr(config, 'PROMPT_FIELD_TOKENS', 250)  # max tokens per free-text lead field
+PROMPT_USER_TOKENS = getattr(config, 'PROMPT_USER_TOKENS', 1200)  # max tokens of lead data per prompt
+MIN_FIELD_TOKENS = 30  # free-text fields are never trimmed below this
+
+# optional exact token counts (pip install tiktoken); otherwise about 4 characters per token
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+def load_encoding():
+    try:
+        return tiktoken.get_encoding('cl100k_base') if tiktoken else None
+    except Exception:  # encoding files could not be fetched
+        return None
+
+
+encoding = load_encoding()
+
+# free-text lead fields trimmed to the token budget (relationship fields as (relationship, field))
+FREE_TEXT_FIELDS = ['Description', 'Notes__c', 'Most_Recent_Campaign_Description__c',
+                    ('Most_Recent_Campaign__r', 'Description')]
+
+
+# background knowledge/ context shared by every section (first, so all prompts share a cacheable prefix)
+DOCUMENTATION = (
+    "You are an AI assistant that helps the RingCentral sales reps understand and "
+    "engage with their leads effectively. Using the provided lead data, you will analyze and "
+    "generate insights. Your goal is to help RingCentral sales reps sell and convert leads into opportunities. "
+    "Use the following field value documentation "
+    "to ensure that your responses are insightful, relevant,and tailored to the sales funnel stages. "
+    "- Title: Lead's job position for its company "
+    "- Company: Business or organization the lead is representing. The business we want to sell our product to "
+    "- Status: "
+    "   - X. Suspect: the initial stage where leads are part of the total addressable market. "
+    "   - X. Open: Early interest is shown, but the lead has not been qualified. "
+    "   - 1. New: Leads are ready for initial sales contact through email or phone. "
+    "   - 1.5. Call out: Leads are actively engaged by the sales team. "
+    "   - 2. Contacted: Leads have been contacted and are being nurtured. "
+    "   - 0. Downgraded: Leads that are not currently viable but may be revisited. "
+    "   - .5. Re-New: Downgraded leads that have been re-engaged. "
+    "- Lead Source: how a lead enters the RingCentral system."
+    "- Description: additional description describing the lead."
+    "- Lead Entry Source: specific source of entry where lead entered the RingCentral system. "
+    "- Recent Campaign Product: product being advertised for campaign. "
+    "- Recent Campaign Date: date lead entered campaign. "
+    "- Recent_Campaign Description: brief description of campaign. "
+    "- Recent Campaign Name: campaign last advertised to lead. "
+    "- Campaign History: 5 most recent campaigns along with the products advertised in those campaigns. "
+    "- Most Recent Campaign detailed Description: full description of most recent campaign. "
+    "- Notes: additional information on lead. "
+    "Generate concise bullet points summarizing key details. "
+    "Each point should be one sentence or less, focusing only on essential information for "
+    "quick reference by a sales rep. "
+    "Make sure that the information is direct/ to the point, and relevant to what a sales rep "
+    "may want to know when talking/ engaging with a lead. The information/ insights you provide "
+    "should be quick and easy to read (does not need to be full complete sentences-- sales reps"
+    "should be able to glance at information and understand what to address with lead immediately). "
+    "Sales reps need to be able to look at the generated insights/ inferences "
+    "and make quick decisions for how they will engage/ sell the RingCentral business. "
+)
+
+# RC products and their plans/ pricing
+RC_PRODUCTS = (
+    "Here is a list of all the products offered by RingCentral along with the possible plans "
+    "and pricing that comes with each product. For each : "
+    "- Phone Systems: "
+    "   - Product: RingEX-- includes a core plan, advanced plan (most popular), and ultra plan (best value) "
+    "      - features included: "
+    "         - business phone system: AI cloud calling (easy to deploy and to use across all devices) "
+    "         - personal AI assistant: real time AI note taking during calls "
+    "             - personalizes insights"
+    "             - crafts messages "
+    "         - enhanced business SMS: business texting optimized for deliver-ability "
+    "         - messaging: team collaboration, chat, and file sharing "
+    "         - video meetings: AI meetings with whiteboard and recording "
+    "         - cloud faxing: easy, secure digital faxing from any device "
+    "   - RingSense AI for RingEX-- need to join wait-list "
+    "- Contact Center: "
+    "   - Product: RingCX powered by RingSense AI "
+    "      - features included: "
+    "         - omnichannel: customer engagement across voice and 20+ digital channel with built in AI "
+    "         - workforce engagement management: AI quality/ workforce management, conversation analytics"
+    "         - outbound: dynamic outbound contact center with built-in campaign management "
+    "   - Product: RingCentral Contact Center Enterprise "
+    "- Video: "
+    "   - Product: Video Pro "
+    "   - Product: Video Pro+ "
+    "   - Product: Webinar-- large meeting and webinars made effortless with AI "
+    "   - Product: Rooms-- video enabled conference rooms and meeting spaces with one click join "
+    "- Events: "
+    "   - Product: Events-- all in one, AI powered event management for virtual, hybrid, and in person events  "
+    "- Sales Intelligence: "
+    "   - RingSense for Sales-- AI sales and conversation intelligence; boosts team collaboration and strategy  "
+    "Do research on each RingCentral product and identify their "
+    "individual value propositions and functions. Additionally, do research on the different RingCentral "
+    "Plans and Pricing offered for these products. "
+)
+
+# per section instructions, appended to the documentation
+SECTION_PROMPTS = {
+    "Product Interest": (
+        RC_PRODUCTS + " "
+        # f"Here is a list of all the products that RingCentral has to offer: {products}. "
+        "Do external research on the lead's company background, including recent news, "
+        "industry, and business model, and suggest which RingCentral product(s) the lead might "
+        "be most interested in. "
+        "Using all the collected information and the lead data-- "
+        "leadSource, Lead_Entry_Source, most recent campaign information, and campaign product-- "
+        "come up with 1-2 RingCentral products (choose from the ones listed tagged 'Product: <Product name>') "
+        "the lead may be interested in. "
+        "In bullet points, provide the following information for each RingCentral product: "
+        "- **Product**: <Product name> "
+        "- **Recommended Pricing Plan**: <ideal pricing plan (only provide this bullet if applicable)> "
+        "- **Why**: <one sentence reasoning a sales rep could use to advertise "
+        "and cater the product towards  the lead. Make sure to connect the lead company's needs with "
+        "the features of the suggested product(s). "
+        "Be sure to use the lead's industry context, company size, company location, and "
+        "past product interest data from similar companies where it is applicable/ available> "
+        "NOTE: Ensure that each bullet is not overwhelmed with information. Remember to get "
+        "straight to the point (do not use full sentences, insights provided should just be notes for a sales "
+        "rep to use when engaging with the lead). "
+        "NOTE: Your response should only include the information about the RingCentral product "
+        "the lead may be interested in. Do not provide any additional information in your response. "
+    ),
+    "Where and Why": (
+        "Assess the lead's journey by looking at their Status and most recent campaign information. "
+        "Use the Description and Notes__c if relevant. "
+        "Summarize the following information about the lead in three bullets: "
+        "- **Where**: <where the start of the lead's journey with RingCentral began> "
+        "- **Why**: <why the lead entered the RingCentral system>  "
+        "- **Current**: <their current relationship with RingCentral>"
+    ),
+    "Historical Relationship": (
+        "Provide a bulleted rundown (no more than 2-4 bullets) of the lead's historical relationship with "
+        "RingCentral. Identify a pattern, a consistent interest in a certain part of the RingCentral business/ "
+        "product or anything that stands out with the campaign history provided "
+        "(use specific campaign names and products). "
+        "Provided will be 5 (if applicable) most recent campaigns the lead engaged with. "
+    ),
+    "Sales Enablement Hook": (
+        "Develop a compelling sales enablement hook. This hook should be creative, leverage recent industry "
+        "trends or company news, and directly address potential pain points or needs identified by the lead. "
+        "The hook should be in the form of a bulleted list (no more than 3 bullets) that highlights "
+        "talking points the sales rep could use. Remember to get "
+        "straight to the point (do not use full sentences, insights provided should just be notes for a sales "
+        "rep to use when engaging with the lead). "
+        "Make sure that talking points are applicable to the most recent news on the lead's company "
+        "or pain points. Be specific with the recent updates/ pain points about the company and relate them "
+        "to how RingCentral can provide a solution for them. "
+        "NOTE: your response should only include the sales enablement hook. "
+        "Do not provide any additional information. "
+    ),
+    "Ask more": (
+        "Respond to the sales rep's inquiries about the lead. "
+        "If questions about the company arise, conduct external research. "
+        "For questions regarding specific detail about the lead, rely on the provided lead data "
+        "and campaign history to offer insightful responses. However, do not fabricate any information-- "
+        "stick strictly to the data you have. It's acceptable to inform the user if you do not have access to "
+        "certain requested information. "
+        "It's also important to disclose that the information you're working with is limited. "
+        "The details you can share with the user include: "
+        "lead name, company name, lead's title at the company, contact information, "
+        "SDR agents, company size, lead status, lead source, lead entry source, "
+        "information about the most recent campaign the lead engaged with, and the five most recently "
+        "attended campaigns. "
+        "Any other information is beyond your current knowledge. "
+        "Here is the lead data and campaign history: "
+    )
+}
+
+
+# full system prompt per section, built once; "Ask more" gets the lead data appended per call
+SYSTEM_PROMPTS = {section: DOCUMENTATION + prompt for section, prompt in SECTION_PROMPTS.items()}
+
+
+def count_tokens(text):
+    """tokens in text (exact with tiktoken installed, otherwise about 4 characters per token)"""
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# token counts of the precompiled system prompts, by text, so they are not re-encoded per request
+SYSTEM_PROMPT_TOKENS = {prompt: count_tokens(prompt) for prompt in SYSTEM_PROMPTS.values()}
+
+
+def count_message_tokens(messages):
+    """prompt tokens of chat messages"""
+    return sum(SYSTEM_PROMPT_TOKENS.get(message['content']) or count_tokens(message['content'] or '')
+               for message in messages)
+
+
+def combined_system_prompt(sections, hook_section):
+    """system prompt asking for every section in one JSON completion"""
+    return (
+        DOCUMENTATION
+        + "Write all four sections of the battle card in a single response. "
+        "Respond only with a JSON object with exactly these keys: "
+        + ", ".join(f'"{section}"' for section in sections)
+        + ". Each value is a string holding that section's bullet points. "
+        "Instructions for each key: "
+        + " ".join(f'"{section}": {SECTION_PROMPTS[section]}' for section in sections)
+        + f'Base the "{hook_section}" on the other three sections you wrote. '
+    )
+
+
+def system_prompt(section_title, lead_data=None, campaign_history=None):
+    """system prompt for a section (static text first, per-lead data last)"""
+    if section_title == "Ask more":
+        return (
+            f"{SYSTEM_PROMPTS[section_title]}"
+            f"{format_user_prompt(lead_data=lead_data)} {format_user_prompt(campaign_history=campaign_history)}"
+        )
+    return SYSTEM_PROMPTS.get(section_title, DOCUMENTATION + "Invalid section title")
+
+
+def trim_text(text, max_tokens):
+    """cuts free text to max_tokens at a word boundary and marks the cut"""
+    if not isinstance(text, str) or count_tokens(text) <= max_tokens:
+        return text
+    cut = encoding.decode(encoding.encode(text)[:max_tokens]) if encoding else text[:max_tokens * 4]
+    return cut.rsplit(" ", 1)[0].rstrip() + " ...[trimmed]"
+
+
+def free_text(lead_data, field):
+    if isinstance(field, tuple):
+        return (lead_data.get(field[0]) or {}).get(field[1])
+    return lead_data.get(field)
+
+
+def format_lead(lead_data, field_tokens):
+    """lead data prompt with each free-text field cut to field_tokens"""
+    campaign = lead_data.get('Most_Recent_Campaign__r') or {}
+    return (
+        f"Title: {lead_data.get('Title', 'N/A')}, "
+        f"Company: {lead_data.get('Company', 'N/A')}, "
+        f"Number of Employees: {lead_data.get('NumberOfEmployees__c', 'N/A')}, "
+        f"Status: {lead_data.get('Status', 'N/A')}, "
+        f"Lead Source: {lead_data.get('LeadSource', 'N/A')}, "
+        f"Description: {trim_text(lead_data.get('Description', 'N/A'), field_tokens)}, "
+        f"Lead Entry Source: {lead_data.get('Lead_Entry_Source__c', 'N/A')}, "
+        f"Recent Campaign Date: {lead_data.get('Most_Recent_Campaign_Associated_Date__c', 'N/A')}, "
+        "Recent Campaign Description: "
+        f"{trim_text(lead_data.get('Most_Recent_Campaign_Description__c', 'N/A'), field_tokens)}, "
+        f"Recent Campaign: {lead_data.get('Most_Recent_Campaign__c', 'N/A')}, "
+        f"Recent Campaign Name: {campaign.get('Name', 'N/A')}, "
+        f"Recent Campaign Product: {campaign.get('Intended_Product__c', 'N/A')}, "
+        f"Recent Campaign Detailed Description: {trim_text(campaign.get('Description', 'N/A'), field_tokens)}, "
+        f"Notes: {trim_text(lead_data.get('Notes__c', 'N/A'), field_tokens)}"
+    )
+
+
+def format_user_prompt(lead_data=None, campaign_history=None):
+    """Formats lead data or campaign history into a compact string for the user prompt.
+    Free-text lead fields are cut to PROMPT_FIELD_TOKENS, and further (down to MIN_FIELD_TOKENS)
+    until the lead data fits PROMPT_USER_TOKENS."""
+    if lead_data:  # formatting string for lead_data json
+        field_tokens = PROMPT_FIELD_TOKENS
+        prompt = format_lead(lead_data, field_tokens)
+        while count_tokens(prompt) > PROMPT_USER_TOKENS and field_tokens > MIN_FIELD_TOKENS:
+            field_tokens = max(MIN_FIELD_TOKENS, field_tokens // 2)
+            prompt = format_lead(lead_data, field_tokens)
+        for field in FREE_TEXT_FIELDS:
+            text = free_text(lead_data, field)
+            if isinstance(text, str) and count_tokens(text) > field_tokens:
+                metrics.prompt_fields_trimmed.inc(field=".".join(field) if isinstance(field, tuple) else field)
+        return prompt
+    elif campaign_history:  # formatting string for campaign_history json
+        history_entries = []
+        for entry in campaign_history:
+            campaign = entry.get('Campaign', {})
+            history_entries.append(
+                f"Campaign Name: {campaign.get('Name', 'N/A')}, "
+                f"Product: {campaign.get('Intended_Product__c', 'N/A')}, "
+                f"Date: {campaign.get('CreatedDate', 'N/A')}"
+            )
+        return " | ".join(history_entries)
+
+    return "No data available"
@@ -0,0 +1,176 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+
+# retry backoff (seconds): full jitter over an exponentially growing window
+RETRY_BASE = 0.5
+RETRY_MAX = 8
+
+
+class Throttled(Exception):
+    """work was not admitted (queue full, no quota before the deadline, or the upstream API kept
+    throttling); retry_after is a hint in seconds for the caller"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """thread-safe token bucket: refills `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1, timeout=None):
+        """blocks until `tokens` are available, then takes them; with a timeout, returns False
+        (without waiting) once the wait would run past it"""
+        tokens = min(tokens, self.capacity)  # oversized requests wait for a full bucket
+        give_up = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if give_up is not None and time.monotonic() + wait > give_up:
+                return False
+            time.sleep(wait)
+
+    def release(self, tokens=1):
+        """returns tokens taken by acquire for work that never ran"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + min(tokens, self.capacity))
+
+
+# request deadline shared by every upstream call made for the current request
+request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+def set_deadline(seconds):
+    """starts the current request's deadline (copied into pool threads by metrics.propagate)"""
+    request_deadline.set(time.monotonic() + seconds)
+
+
+def deadline(limit):
+    """the request's deadline, capped at `limit` seconds from now"""
+    capped = time.monotonic() + limit
+    current = request_deadline.get()
+    return min(current, capped) if current is not None else capped
+
+
+class Limiter:
+    """admission control for one upstream API: a request bucket, an optional token bucket
+    (e.g. OpenAI tokens per minute) and an optional concurrency cap; at most max_queue callers
+    wait for admission, anything beyond that is rejected instead of piling up"""
+
+    def __init__(self, name, requests, tokens=None, max_concurrent=None, max_queue=100):
+        self.name = name
+        self.requests = requests
+        self.tokens = tokens
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.max_queue = max_queue
+        self.queued = 0
+        self.stats = {'admitted': 0, 'delayed': 0, 'rejected': 0, 'timeouts': 0, 'upstream_errors': 0,
+                      'retries': 0}
+        self._lock = threading.Lock()
+
+    def count(self, event):
+        with self._lock:
+            self.stats[event] += 1
+        if event != 'admitted':
+            metrics.throttle_events.inc(api=self.name, event=event)
+
+    def _enqueue(self, change):
+        with self._lock:
+            if change > 0 and self.queued >= self.max_queue:
+                return False
+            self.queued += change
+            metrics.queue_depth.set(self.queued, api=self.name)
+        return True
+
+    def _wait(self, deadline, tokens):
+        """takes a request (plus tokens) and a concurrency slot, or returns False at the deadline
+        (handing back whatever it already took, since no call is made)"""
+        start = time.monotonic()
+        tokens = tokens if self.tokens else 0
+        if not self.requests.acquire(1, timeout=deadline - time.monotonic()):
+            return False
+        if tokens and not self.tokens.acquire(tokens, timeout=deadline - time.monotonic()):
+            self.requests.release(1)
+            return False
+        if self.slots and not self.slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            self.requests.release(1)
+            if tokens:
+                self.tokens.release(tokens)
+            return False
+        if time.monotonic() - start > 0.01:
+            self.count('delayed')
+        return True
+
+    @contextmanager
+    def admit(self, deadline, tokens=0):
+        """holds a place under the API's limits for the block; raises Throttled when the queue
+        is full or the limits leave no room before the deadline"""
+        if not self._enqueue(1):
+            self.count('rejected')
+            raise Throttled(f"{self.name} queue is full ({self.max_queue} waiting)")
+        try:
+            admitted = self._wait(deadline, tokens)
+        finally:
+            self._enqueue(-1)
+        if not admitted:
+            self.count('timeouts')
+            raise Throttled(f"{self.name} rate limit leaves no room before the request deadline")
+        self.count('admitted')
+        try:
+            yield
+        finally:
+            if self.slots:
+                self.slots.release()
+
+    def status(self):
+        with self._lock:
+            current = dict(self.stats)
+            current['queued'] = self.queued
+        current['max_queue'] = self.max_queue
+        return current
+
+
+def call_with_retry(limiter, fn, deadline, retry_after, tokens=0):
+    """runs fn under the limiter, retrying errors for which retry_after(error) returns a delay
+    (0 if the API gave none; None means the error is not retryable) with jittered exponential
+    backoff; raises Throttled once the next attempt would miss the deadline"""
+    attempt = 0
+    while True:
+        with limiter.admit(deadline, tokens):
+            try:
+                return fn()
+            except Exception as call_error:
+                delay = retry_after(call_error)
+                if delay is None:
+                    raise
+                error = call_error
+        limiter.count('upstream_errors')
+        backoff = max(delay, random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt)))
+        if time.monotonic() + backoff >= deadline:
+            raise Throttled(f"{limiter.name} unavailable after {attempt + 1} attempts: {error}",
+                            retry_after=max(1, round(backoff))) from error
+        limiter.count('retries')
+        time.sleep(backoff)  # the concurrency slot is free while backing off
+        attempt += 1
@@ -0,0 +1,37 @@
+import threading
+
+
+class SingleFlight:
+    """coalesces concurrent calls that share a key into one in-flight computation:
+    the first caller runs it and every other caller waits for (and shares) its result or error;
+    nothing is remembered once the call finishes"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """returns (result, coalesced) where coalesced is True if another caller did the work"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result'], True
+
+        try:
+            call['result'] = fn(*args, **kwargs)
+        except BaseException as call_error:
+            call['error'] = call_error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]  # failures are not cached: the next caller starts a new call
+            call['done'].set()
+        return call['result'], False
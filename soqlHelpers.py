@@ -0,0 +1,27 @@
+import time
+
+
+CHUNK_SIZE = 200  # values per IN (...) clause
+SYNC_OVERLAP = 60  # seconds incremental SystemModstamp syncs re-read to cover clock skew and in-flight transactions
+
+
+def soql_list(values):
+    """formats values as a quoted, escaped SOQL IN (...) list"""
+    return ", ".join("'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'" for value in values)
+
+
+def chunked(values, size):
+    """splits values into lists of at most `size` items (one IN (...) clause each)"""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def record_key(recordID):
+    """15 character form of a SFDC ID so 15 and 18 character IDs match"""
+    return recordID[:15]
+
+
+def soql_datetime(timestamp):
+    """unix timestamp as a SOQL datetime literal"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
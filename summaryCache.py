@@ -0,0 +1,192 @@
+import threading
+import concurrent.futures
+import config
+import clientManager
+import generateSummary
+import metrics
+from cacheStore import LRUCache, SQLiteStore
+from singleFlight import SingleFlight
+
+
+# summary cache settings (override in config.py)
+SUMMARY_CACHE_SIZE = getattr(config, 'SUMMARY_CACHE_SIZE', 256)  # max cards kept in memory
+SUMMARY_CACHE_PATH = getattr(config, 'SUMMARY_CACHE_PATH', None)  # SQLite file for the disk tier (None disables it)
+SUMMARY_CACHE_TTL = getattr(config, 'SUMMARY_CACHE_TTL', 7 * 86400)  # seconds a card is kept (both tiers)
+SUMMARY_CACHE_DISK_SIZE = getattr(config, 'SUMMARY_CACHE_DISK_SIZE', 20000)  # max cards kept on disk
+
+memory_cache = LRUCache(SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+disk_cache = SQLiteStore(SUMMARY_CACHE_PATH, 'lead_summaries', ttl=SUMMARY_CACHE_TTL,
+                         max_entries=SUMMARY_CACHE_DISK_SIZE) if SUMMARY_CACHE_PATH else None
+
+stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'refreshes': 0, 'coalesced': 0}
+stats_lock = threading.Lock()
+
+# concurrent requests for the same lead share one computation
+lead_flights = SingleFlight()
+
+
+def count(stat):
+    with stats_lock:
+        stats[stat] += 1
+
+
+def query_lead_version(leadID):
+    """cheap freshness probe: the lead's SystemModstamp plus its latest CampaignMember change"""
+    querySOQL = f"""
+        SELECT SystemModstamp,
+            (SELECT SystemModstamp FROM CampaignMembers ORDER BY SystemModstamp DESC LIMIT 1)
+        FROM Lead
+        WHERE Id = '{leadID}'
+    """
+    result = clientManager.sf_query(querySOQL)
+    if not result['records']:  # unknown lead, nothing to cache
+        return None
+    record = result['records'][0]
+    members = (record.get('CampaignMembers') or {}).get('records') or [{}]
+    return format_version(record.get('SystemModstamp'), members[0].get('SystemModstamp'))
+
+
+def format_version(lead_modstamp, member_modstamp):
+    """cache version for a lead: its SystemModstamp plus its latest CampaignMember SystemModstamp"""
+    return f"{lead_modstamp}|{member_modstamp}"
+
+
+def generation_mode(mode):
+    return mode or generateSummary.GENERATION_MODE
+
+
+def get_cached_summary(leadID, version, mode=None, duplicates=None):
+    """looks up a card for this lead version and generation mode in memory, then on disk;
+    duplicates are not covered by the version, so a hit gets the current ones (`duplicates`, or
+    the future from prefetch_duplicates, if the caller has them, otherwise looked up by the card's email)"""
+    entry = memory_cache.get(leadID)
+    if entry and entry['version'] == version and entry.get('mode') == generation_mode(mode):
+        count('hits')
+        return with_duplicates(leadID, entry['summary'], duplicates)
+    if disk_cache:
+        entry = disk_cache.get(leadID)
+        if entry and entry['version'] == version and entry.get('mode') == generation_mode(mode):
+            memory_cache.set(leadID, entry)  # promote to memory tier
+            count('disk_hits')
+            return with_duplicates(leadID, entry['summary'], duplicates)
+    count('misses')
+    return None
+
+
+def with_duplicates(leadID, summary, duplicates=None):
+    """copy of a cached card with its duplicate leads/ opportunities re-resolved (served by the
+    local email index when it is current)"""
+    if isinstance(duplicates, concurrent.futures.Future):
+        duplicates = duplicates.result()
+    if duplicates is None:
+        duplicates = generateSummary.query_duplicates(leadID, summary.get("Email") or "")
+    summary = dict(summary)
+    summary["Duplicate Leads"] = duplicates.get('Duplicate Leads')
+    summary["Duplicate Opportunities"] = duplicates.get('Duplicate Opportunities')
+    return summary
+
+
+def prefetch_duplicates(leadID, mode):
+    """starts the duplicate lookup for the card cached in memory (by its email) so it runs alongside
+    the freshness probe; None when no card for this mode is cached"""
+    entry = memory_cache.get(leadID)
+    if not entry or entry.get('mode') != generation_mode(mode):
+        return None
+    return generateSummary.sfdc_pool.submit(metrics.propagate(generateSummary.query_duplicates), leadID,
+                                            entry['summary'].get("Email") or "")
+
+
+def store_summary(leadID, version, summary, mode=None):
+    entry = {'version': version, 'mode': generation_mode(mode), 'summary': summary}
+    memory_cache.set(leadID, entry)
+    if disk_cache:
+        disk_cache.set(leadID, entry)
+
+
+def is_cacheable(summary):
+    """failed queries, partial cards and sections that hit an OpenAI error are never cached"""
+    if not summary or "error" in summary or summary.get("errors") or summary.get("pending"):
+        return False
+    return not any(generateSummary.is_failed_section(value) for value in summary.values())
+
+
+def get_lead_summary(leadID, refresh=False, mode=None, budget=None):
+    """returns the lead's battle card, rebuilding it only when the lead or its campaigns changed
+    (refresh=True forces a rebuild, mode selects the generation mode for a rebuild, budget returns
+    a partial card with pending sections after that many seconds);
+    concurrent callers for the same lead wait on a single computation"""
+    summary, coalesced = lead_flights.do((leadID, refresh, mode, budget), load_lead_summary, leadID, refresh, mode,
+                                         budget)
+    if coalesced:
+        count('coalesced')
+    return summary
+
+
+def load_lead_summary(leadID, refresh, mode, budget=None):
+    """cache lookup and rebuild behind get_lead_summary (a partial card is cached once it completes)"""
+    duplicates = None if refresh else prefetch_duplicates(leadID, mode)
+    version = query_lead_version(leadID)
+    if version is None:  # let the pipeline report the missing lead
+        return generateSummary.query_and_summarize_lead(leadID, mode=mode, budget=budget)
+
+    if refresh:
+        count('refreshes')
+    else:
+        summary = get_cached_summary(leadID, version, mode, duplicates=duplicates)
+        if summary is not None:
+            return summary
+
+    def store_if_cacheable(summary):
+        if is_cacheable(summary):
+            store_summary(leadID, version, summary, mode)
+
+    summary = generateSummary.query_and_summarize_lead(leadID, mode=mode, budget=budget, on_complete=store_if_cacheable)
+    store_if_cacheable(summary)
+    return summary
+
+
+def cache_stats():
+    """hit/miss counters and current memory tier size"""
+    with stats_lock:
+        current = dict(stats)
+    current['memory_entries'] = len(memory_cache)
+    current['disk_enabled'] = disk_cache is not None
+    return current
+
+
+def stream_lead_summary(leadID, refresh=False, stream_tokens=False, mode=None):
+    """streaming variant of get_lead_summary: yields card events, replaying a cached card at once
+    and caching a freshly streamed card once it is complete"""
+    duplicates = None if refresh else prefetch_duplicates(leadID, mode)
+    version = query_lead_version(leadID)
+    if version is not None and not refresh:
+        summary = get_cached_summary(leadID, version, mode, duplicates=duplicates)
+        if summary is not None:
+            yield from summary_events(summary)
+            return
+    if refresh:
+        count('refreshes')
+
+    summary = {}
+    for event in generateSummary.stream_summary(leadID, stream_tokens=stream_tokens, mode=mode):
+        if event["event"] in ("general", "duplicates"):
+            summary.update(event["data"])
+        elif event["event"] == "section":
+            summary[event["section"]] = event["data"]
+            if event.get("error"):
+                summary.setdefault("errors", {})[event["section"]] = event["error"]
+        elif event["event"] == "done" and version is not None and is_cacheable(summary):
+            store_summary(leadID, version, summary, mode)
+        yield event
+
+
+def summary_events(summary):
+    """replays a complete card as stream events"""
+    sections = generateSummary.SECTIONS
+    duplicate_fields = ["Duplicate Leads", "Duplicate Opportunities"]
+    general_info = {field: value for field, value in summary.items() if field not in sections + duplicate_fields}
+    yield {"event": "general", "data": general_info}
+    yield {"event": "duplicates", "data": {field: summary.get(field) for field in duplicate_fields}}
+    for section in sections:
+        yield {"event": "section", "section": section, "data": summary.get(section)}
+    yield {"event": "done"}
@@ -0,0 +1,150 @@
+import time
+import unittest
+from simple_salesforce.exceptions import SalesforceGeneralError
+import clientManager
+import fakeBackends
+import rateLimit
+
+
+def limiter(requests=10, tokens=None, max_concurrent=None, max_queue=10):
+    """limiter with slowly refilling buckets, so a test controls exactly what is available"""
+    return rateLimit.Limiter('test', rateLimit.TokenBucket(0.001, requests),
+                             tokens=rateLimit.TokenBucket(0.001, tokens) if tokens else None,
+                             max_concurrent=max_concurrent, max_queue=max_queue)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_acquire_until_empty(self):
+        bucket = rateLimit.TokenBucket(0.001, 2)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0.05))
+
+    def test_acquire_waits_for_refill(self):
+        bucket = rateLimit.TokenBucket(20, 1)
+        bucket.acquire()
+        start = time.monotonic()
+        self.assertTrue(bucket.acquire(timeout=1))
+        self.assertGreaterEqual(time.monotonic() - start, 0.03)
+
+    def test_release_is_capped_at_capacity(self):
+        bucket = rateLimit.TokenBucket(0.001, 2)
+        bucket.release(5)
+        self.assertLessEqual(bucket.tokens, 2)
+
+
+class LimiterTest(unittest.TestCase):
+
+    def test_full_queue_is_rejected(self):
+        test_limiter = limiter(max_queue=0)
+        with self.assertRaises(rateLimit.Throttled):
+            with test_limiter.admit(time.monotonic() + 1):
+                pass
+        self.assertEqual(test_limiter.status()['rejected'], 1)
+
+    def test_timeout_hands_back_quota(self):
+        test_limiter = limiter(requests=5, tokens=100, max_concurrent=1)
+        test_limiter.slots.acquire()  # the only concurrency slot is busy
+        with self.assertRaises(rateLimit.Throttled):
+            with test_limiter.admit(time.monotonic() + 0.05, tokens=10):
+                pass
+        self.assertAlmostEqual(test_limiter.requests.tokens, 5, places=2)
+        self.assertAlmostEqual(test_limiter.tokens.tokens, 100, places=2)
+        self.assertEqual(test_limiter.status()['timeouts'], 1)
+
+    def test_slot_is_released_after_the_call(self):
+        test_limiter = limiter(max_concurrent=1)
+        for _ in range(3):
+            with test_limiter.admit(time.monotonic() + 0.05):
+                pass
+        self.assertEqual(test_limiter.status()['admitted'], 3)
+
+
+class CallWithRetryTest(unittest.TestCase):
+
+    def test_retries_retryable_errors(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionError("reset")
+            return "ok"
+
+        test_limiter = limiter()
+        result = rateLimit.call_with_retry(test_limiter, flaky, time.monotonic() + 30, lambda error: 0.01)
+        self.assertEqual(result, "ok")
+        self.assertEqual(test_limiter.status()['retries'], 2)
+
+    def test_other_errors_are_raised(self):
+        def broken():
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            rateLimit.call_with_retry(limiter(), broken, time.monotonic() + 30, lambda error: None)
+
+
+class OpenAIRetryTest(unittest.TestCase):
+    """openai_create against the fake chat-completions server (429/ 500 responses, no network)"""
+
+    def setUp(self):
+        self.saved = (clientManager.openai_client, clientManager.openai_limiter)
+        clientManager.openai_limiter = limiter(requests=100, tokens=1000000)
+
+    def tearDown(self):
+        self.server.stop()
+        clientManager.openai_client, clientManager.openai_limiter = self.saved
+
+    def start_server(self, error_rate):
+        self.server = fakeBackends.FakeOpenAIServer(latency=0, error_rate=error_rate, completion_tokens=5).start()
+        fakeBackends.install(openai_server=self.server)
+
+    def create(self):
+        return clientManager.openai_create(clientManager.openai_client, model='gpt-3.5-turbo',
+                                           messages=[{'role': 'user', 'content': 'hello'}])
+
+    def test_transient_errors_are_retried(self):
+        self.start_server(error_rate=0.5)
+        for _ in range(5):
+            self.assertTrue(self.create().choices[0].message.content)
+        self.assertEqual(self.server.stats['requests'], 5 + self.server.stats['errors'])
+        self.assertEqual(clientManager.openai_limiter.status()['retries'], self.server.stats['errors'])
+
+    def test_persistent_errors_end_in_throttled(self):
+        self.start_server(error_rate=1.0)
+        rateLimit.set_deadline(1)
+        try:
+            with self.assertRaises(rateLimit.Throttled):
+                self.create()
+        finally:
+            rateLimit.request_deadline.set(None)
+        self.assertGreater(self.server.stats['requests'], 1)
+
+
+class SalesforceLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = clientManager.sf_client
+
+    def tearDown(self):
+        clientManager.sf_client = self.saved
+
+    def test_request_limit_exceeded_is_not_retried(self):
+        sf = fakeBackends.FakeSalesforce(latency=0)
+
+        def over_limit(soql, **kwargs):
+            sf.calls += 1
+            raise SalesforceGeneralError('https://fake.salesforce.com/query', 403, 'query',
+                                         [{'errorCode': 'REQUEST_LIMIT_EXCEEDED'}])
+
+        sf.query = over_limit
+        fakeBackends.install(sf)
+        with self.assertRaises(rateLimit.Throttled) as raised:
+            clientManager.sf_query("SELECT Id FROM Lead")
+        self.assertEqual(sf.calls, 1)
+        self.assertEqual(raised.exception.retry_after, clientManager.SFDC_LIMIT_RETRY_AFTER)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import threading
+import time
+import unittest
+import completionCache
+import fakeBackends
+import summaryCache
+from singleFlight import SingleFlight
+
+
+CALLERS = 8
+
+
+def run_concurrently(fn, callers=CALLERS):
+    """calls fn from `callers` threads released together; returns each caller's result or exception"""
+    barrier = threading.Barrier(callers)
+    outcomes = [None] * callers
+
+    def caller(index):
+        barrier.wait()
+        try:
+            outcomes[index] = fn()
+        except Exception as error:
+            outcomes[index] = error
+
+    threads = [threading.Thread(target=caller, args=(index,)) for index in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return outcomes
+
+
+class SingleFlightTest(unittest.TestCase):
+    """concurrent callers on one key share a single call (plain threads, no network)"""
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def slow(self, result=None, error=None):
+        with self.lock:
+            self.calls += 1
+        time.sleep(0.2)  # long enough for every caller to join the flight
+        if error:
+            raise error
+        return result if result is not None else {'card': self.calls}
+
+    def test_callers_share_one_call(self):
+        outcomes = run_concurrently(lambda: self.flights.do('lead', self.slow))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual({id(result) for result, _ in outcomes}, {id(outcomes[0][0])})  # the same object
+        self.assertEqual(sum(not coalesced for _, coalesced in outcomes), 1)
+
+    def test_error_reaches_every_waiter(self):
+        error = ValueError("SFDC down")
+        outcomes = run_concurrently(lambda: self.flights.do('lead', self.slow, error=error))
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(all(outcome is error for outcome in outcomes))
+
+    def test_next_call_runs_again(self):
+        with self.assertRaises(ValueError):
+            self.flights.do('lead', self.slow, error=ValueError("first"))
+        result, coalesced = self.flights.do('lead', self.slow)
+        self.assertEqual(self.calls, 2)
+        self.assertFalse(coalesced)
+        self.flights.do('lead', self.slow)
+        self.assertEqual(self.calls, 3)  # finished calls are not remembered
+
+    def test_different_keys_do_not_coalesce(self):
+        keys = iter(range(CALLERS))
+        lock = threading.Lock()
+
+        def next_key():
+            with lock:
+                return next(keys)
+
+        run_concurrently(lambda: self.flights.do(next_key(), self.slow))
+        self.assertEqual(self.calls, CALLERS)
+
+
+class LeadSummaryCoalescingTest(unittest.TestCase):
+    """concurrent /query_lead callers for one lead share one card build (fake SFDC and OpenAI)"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sf = fakeBackends.FakeSalesforce(latency=0.01)
+        cls.openai_server = fakeBackends.FakeOpenAIServer(latency=0.2).start()
+        fakeBackends.install(cls.sf, cls.openai_server)
+        completionCache.COMPLETION_CACHE_ENABLED = False  # every build must reach the fake OpenAI server
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.openai_server.stop()
+        completionCache.COMPLETION_CACHE_ENABLED = True
+
+    def setUp(self):
+        self.openai_server.reset()
+        summaryCache.memory_cache.delete('00Q000000000001')
+
+    def test_concurrent_callers_share_one_build(self):
+        coalesced = summaryCache.cache_stats()['coalesced']
+        outcomes = run_concurrently(lambda: summaryCache.get_lead_summary('00Q000000000001', refresh=True))
+        self.assertTrue(all(isinstance(card, dict) and 'errors' not in card for card in outcomes), outcomes[0])
+        self.assertTrue(all(card == outcomes[0] for card in outcomes))
+        self.assertEqual(self.openai_server.stats['requests'], 4)  # one completion per section, once
+        self.assertEqual(summaryCache.cache_stats()['coalesced'] - coalesced, CALLERS - 1)
+
+    def test_next_request_is_served_from_cache(self):
+        summaryCache.get_lead_summary('00Q000000000001')
+        requests = self.openai_server.stats['requests']
+        outcomes = run_concurrently(lambda: summaryCache.get_lead_summary('00Q000000000001'))
+        self.assertTrue(all(card == outcomes[0] for card in outcomes))
+        self.assertEqual(self.openai_server.stats['requests'], requests)
+
+
+if __name__ == '__main__':
+    unittest.main()
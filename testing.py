@@ -1,5 +1,6 @@
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 url = "http://127.0.0.1:5000/query_lead"
 headers = {
@@ -12,3 +13,14 @@ data = {
 response = requests.post(url, headers=headers, data=json.dumps(data))
 print(response.text)  # debugging
 print(response.json())
+
+# simulate a burst of concurrent callers for the same lead (e.g. a lead shared in a team channel):
+# every caller should receive the same card, and /cache_stats should count the coalesced requests
+concurrent_callers = 5
+refresh_data = dict(data, refresh=True)  # force a rebuild so the callers overlap with real work
+with ThreadPoolExecutor(max_workers=concurrent_callers) as pool:
+    burst = list(pool.map(lambda _: requests.post(url, headers=headers, data=json.dumps(refresh_data)),
+                          range(concurrent_callers)))
+print([r.status_code for r in burst])
+print("identical cards:", all(r.json() == burst[0].json() for r in burst))
+print(requests.get("http://127.0.0.1:5000/cache_stats").json())